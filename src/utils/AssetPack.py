@@ -0,0 +1,116 @@
+import json
+import os
+import cv2
+import numpy as np
+from multiprocessing import Pool
+from pathlib import Path
+from tqdm import tqdm
+
+# Assets wider than this are downscaled when packed.
+# The widest slot in a synthetic compound (1x1 grid) is below PAGE_WIDTH.
+PACK_MAX_WIDTH = 1600
+
+def index_path_for(pack_path):
+    return Path(pack_path).with_suffix(".json")
+
+def _decode_for_pack(args):
+    path, max_width = args
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    h, w = img.shape[:2]
+    if w > max_width:
+        img = cv2.resize(img, (max_width, int(h * max_width / w)), interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(img)
+
+def build_asset_pack(asset_dir, labels_json, pack_path, max_width=PACK_MAX_WIDTH, num_workers=None):
+    """
+    Decodes every labeled asset once and writes them into a single packed binary.
+
+    Args:
+        asset_dir (Path): Folder with the single figure PNGs.
+        labels_json (Path): {filename: label} mapping (single_labels.json).
+        pack_path (Path): Output file for the raw uint8 pixel data.
+        max_width (int): Assets wider than this are downscaled (aspect ratio kept).
+        num_workers (int): Decode processes (default: all cores).
+
+    The index (offset, shape and label per asset) is written next to the pack
+    as `<pack>.json`.
+    """
+    asset_dir = Path(asset_dir)
+    pack_path = Path(pack_path)
+    with open(labels_json, 'r') as f:
+        labels = json.load(f)
+
+    filenames = [fn for fn in labels if (asset_dir / fn).exists()]
+    print(f"Packing {len(filenames)} assets into {pack_path} (max width {max_width}px)...")
+
+    index = {"max_width": max_width, "assets": {}}
+    offset = 0
+    jobs = [(str(asset_dir / fn), max_width) for fn in filenames]
+
+    with Pool(num_workers or os.cpu_count()) as workers, open(pack_path, "wb") as out:
+        decoded = workers.imap(_decode_for_pack, jobs, chunksize=8)
+        for filename, img in tqdm(zip(filenames, decoded), total=len(filenames), desc="Packing"):
+            if img is None:
+                print(f"[Warning] Could not decode {filename}, skipping.")
+                continue
+            out.write(img.tobytes())
+            index["assets"][filename] = {
+                "offset": offset,
+                "shape": list(img.shape),
+                "label": labels[filename],
+            }
+            offset += img.nbytes
+
+    with open(index_path_for(pack_path), "w") as f:
+        json.dump(index, f)
+    print(f"Done! {len(index['assets'])} assets, {offset / 1024**3:.2f} GB")
+    return index
+
+class AssetPack:
+    """
+    Read-only view on a packed asset file.
+    The pixel data is memory-mapped, so all processes share the page cache.
+    """
+    def __init__(self, pack_path):
+        self.pack_path = Path(pack_path)
+        with open(index_path_for(self.pack_path), 'r') as f:
+            index = json.load(f)
+        self.max_width = index["max_width"]
+        self.assets = index["assets"]
+        self._data = None
+
+    def _mapped(self):
+        # Opened lazily so the pack can be pickled to worker processes cheaply
+        if self._data is None:
+            self._data = np.memmap(self.pack_path, dtype=np.uint8, mode="r")
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def __contains__(self, filename):
+        return filename in self.assets
+
+    def __len__(self):
+        return len(self.assets)
+
+    def shape(self, filename):
+        return tuple(self.assets[filename]["shape"])
+
+    def get(self, filename):
+        """Returns the (read-only) BGR image of one asset, without copying."""
+        entry = self.assets[filename]
+        h, w, c = entry["shape"]
+        start = entry["offset"]
+        return self._mapped()[start:start + h * w * c].reshape(h, w, c)
+
+def main():
+    from SyntheticCompoundGenerator import ASSET_DIR, JSON_INPUT_PATH, ASSET_PACK_PATH
+    build_asset_pack(ASSET_DIR, JSON_INPUT_PATH, ASSET_PACK_PATH)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+import argparse
+import json
+import time
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tqdm import tqdm
+
+try:
+    from SyntheticCompoundGenerator import LABEL_STUDIO_MAPPING
+    from ShardedArchive import ShardReader, has_shards, IMAGE_EXTENSIONS
+    from TrainingImageCache import letterbox
+except ImportError:  # Imported as utils.CompoundInference (notebooks)
+    from utils.SyntheticCompoundGenerator import LABEL_STUDIO_MAPPING
+    from utils.ShardedArchive import ShardReader, has_shards, IMAGE_EXTENSIONS
+    from utils.TrainingImageCache import letterbox
+
+# --- KONFIGURATION ---
+WEIGHTS = Path("../../runs/detect/compound_yolo11s_960_optimized/weights/best.pt")
+OUTPUT_DIR = Path("../../dataset/05_inference")
+IMGSZ = 960
+BATCH_SIZE = 8
+CONF = 0.25
+IOU = 0.7             # Same as the training run's validation (args.yaml)
+MAX_DET = 300
+DECODE_THREADS = 4    # cv2 decode/resize release the GIL
+WRITE_THREADS = 2
+CROP_FORMAT = "png"
+
+CLASS_NAMES = {item['id']: item['name'] for item in LABEL_STUDIO_MAPPING}
+
+class TorchBackend:
+    """Trained ultralytics weights (.pt) on the CPU, Conv+BN fused, raw head output."""
+    def __init__(self, weights, threads=None):
+        import torch
+        from ultralytics import YOLO
+        if threads:
+            torch.set_num_threads(threads)
+        self._torch = torch
+        self.model = YOLO(str(weights)).model.float().fuse(verbose=False).eval()
+
+    def __call__(self, batch):
+        """(B, 3, H, W) float32 RGB 0..1 -> (B, 4 + classes, anchors) float32."""
+        with self._torch.inference_mode():
+            out = self.model(self._torch.from_numpy(batch))
+        return (out[0] if isinstance(out, (list, tuple)) else out).numpy()
+
+class OnnxBackend:
+    """
+    Exported model (.onnx, FP32 or INT8) in ONNX Runtime on the CPU.
+    threads: intra-op threads (within an operator), inter_threads: inter-op threads
+    (parallel branches of the graph, only used if > 1).
+    """
+    def __init__(self, model_path, threads=None, inter_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        if inter_threads and inter_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+            options.inter_op_num_threads = inter_threads
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Static exports fix the batch size, dynamic ones report a name instead of a number
+        self.batch_size = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+    def __call__(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+def load_backend(weights, threads=None, inter_threads=None):
+    weights = Path(weights)
+    if weights.suffix == ".pt":
+        return TorchBackend(weights, threads)
+    if weights.suffix == ".onnx":
+        return OnnxBackend(weights, threads, inter_threads)
+    raise ValueError(f"Unsupported weights format: {weights}")
+
+def prepare(img, imgsz=IMGSZ):
+    """Letterboxes a BGR image to imgsz x imgsz; returns (CHW RGB uint8, scale, pad)."""
+    boxed, scale, pad = letterbox(img, imgsz, square=True)
+    return np.ascontiguousarray(boxed[:, :, ::-1].transpose(2, 0, 1)), scale, pad
+
+def to_batch(tensors):
+    return np.stack(tensors).astype(np.float32) / 255.0
+
+def postprocess(pred, scale, pad, orig_shape, conf=CONF, iou=IOU, max_det=MAX_DET):
+    """
+    Decodes one image of the YOLO head output (4 + classes, anchors) into
+    detections in original image pixels, with class-aware NMS.
+
+    Returns:
+        list: Dicts with class_id, class_name, confidence and bbox (x0, y0, x1, y1).
+    """
+    pred = pred.T
+    scores = pred[:, 4:]
+    class_ids = scores.argmax(1)
+    confidences = scores[np.arange(len(pred)), class_ids]
+    keep = confidences >= conf
+    pred, class_ids, confidences = pred[keep], class_ids[keep], confidences[keep]
+    if not len(pred):
+        return []
+
+    h, w = orig_shape[:2]
+    cx, cy = (pred[:, 0] - pad[0]) / scale, (pred[:, 1] - pad[1]) / scale
+    bw, bh = pred[:, 2] / scale, pred[:, 3] / scale
+    x0, y0 = np.clip(cx - bw / 2, 0, w), np.clip(cy - bh / 2, 0, h)
+    x1, y1 = np.clip(cx + bw / 2, 0, w), np.clip(cy + bh / 2, 0, h)
+    boxes = np.stack([x0, y0, x1 - x0, y1 - y0], axis=1)
+    keep = cv2.dnn.NMSBoxesBatched(boxes.tolist(), confidences.tolist(), class_ids.tolist(), conf, iou)
+    keep = sorted(np.asarray(keep, dtype=int).ravel(), key=lambda i: -confidences[i])[:max_det]
+    return [{
+        "class_id": int(class_ids[i]),
+        "class_name": CLASS_NAMES.get(int(class_ids[i]), str(class_ids[i])),
+        "confidence": round(float(confidences[i]), 4),
+        "bbox": [round(float(v), 1) for v in (x0[i], y0[i], x1[i], y1[i])],
+    } for i in keep]
+
+def iter_sources(input_path):
+    """
+    (key, loader) for every image in a folder (recursive), a list of paths, or the
+    extractor's shards; loader() returns a path or the encoded bytes.
+    Keys name the output files: the file stem for a list of paths, the path relative
+    to the folder for a folder ('sub/fig.png' -> 'sub__fig'). Raises ValueError if
+    two images would get the same key.
+    """
+    input_path = Path(input_path)
+    shard_dir = input_path / "shards" if has_shards(input_path / "shards", "figures") else input_path
+    if has_shards(shard_dir, "figures"):
+        reader = ShardReader(shard_dir, "figures")
+        for key in reader.keys():
+            ext = next(e for e in IMAGE_EXTENSIONS if e in reader.members(key))
+            yield key, (lambda key=key, ext=ext: reader.read(key, ext))
+        return
+    if input_path.is_file():
+        with open(input_path, 'r') as f:
+            paths = list(dict.fromkeys(Path(line.strip()) for line in f if line.strip()))
+        keys = [path.stem for path in paths]
+    else:
+        paths = sorted(p for p in input_path.rglob("*") if p.suffix.lower().lstrip(".") in IMAGE_EXTENSIONS)
+        keys = [path.relative_to(input_path).with_suffix("").as_posix().replace("/", "__") for path in paths]
+    # Checked before the first image: a collision would silently overwrite results
+    first = {}
+    for key, path in zip(keys, paths):
+        if key in first:
+            raise ValueError(f"{first[key]} and {path} map to the same output key {key!r}, rename one of them.")
+        first[key] = path
+    for key, path in zip(keys, paths):
+        yield key, (lambda path=path: path)
+
+def _decode(job):
+    key, loader, imgsz = job
+    t = time.perf_counter()
+    source = loader()
+    if isinstance(source, Path):
+        img = cv2.imread(str(source))
+    else:
+        img = cv2.imdecode(np.frombuffer(source, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return key, None, None, time.perf_counter() - t
+    return key, img, prepare(img, imgsz), time.perf_counter() - t
+
+def _bounded_map(executor, fn, jobs, lookahead):
+    """executor.map with at most `lookahead` tasks in flight (memory stays flat on big folders)."""
+    pending = []
+    for job in jobs:
+        pending.append(executor.submit(fn, job))
+        if len(pending) >= lookahead:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+def write_crops(output_dir, key, img, detections):
+    """Writes crops/<key>_<i>_<class>.<fmt> per detection and stores the path in det["crop"]."""
+    for i, det in enumerate(detections):
+        x0, y0, x1, y1 = (int(round(v)) for v in det["bbox"])
+        if x1 <= x0 or y1 <= y0:
+            continue
+        det["crop"] = f"crops/{key}_{i}_{det['class_name'].replace(' ', '-')}.{CROP_FORMAT}"
+        cv2.imwrite(str(Path(output_dir) / det["crop"]), img[y0:y1, x0:x1])
+
+def write_result(output_dir, key, img, detections, save_crops=True):
+    """<key>.json with the detections and, if save_crops, the crops."""
+    output_dir = Path(output_dir)
+    if save_crops:
+        write_crops(output_dir, key, img, detections)
+    with open(output_dir / f"{key}.json", "w") as f:
+        json.dump({"image": key, "width": img.shape[1], "height": img.shape[0], "detections": detections}, f, indent=4)
+
+class Detector:
+    """
+    Backend + letterbox/NMS settings. Batches are always batch_size images (a short
+    last batch is padded), so backends with static input shapes work too.
+    """
+    def __init__(self, backend, imgsz=IMGSZ, batch_size=BATCH_SIZE, conf=CONF, iou=IOU, max_det=MAX_DET):
+        self.backend = backend
+        self.imgsz, self.batch_size = imgsz, batch_size
+        self.conf, self.iou, self.max_det = conf, iou, max_det
+
+    def infer(self, prepared):
+        """prepared: [(CHW uint8, scale, pad)] -> raw head output per image."""
+        tensors = [p[0] for p in prepared]
+        tensors += [np.zeros_like(tensors[0])] * (self.batch_size - len(tensors))
+        return self.backend(to_batch(tensors))[:len(prepared)]
+
+    def decode(self, pred, prepared, shape):
+        return postprocess(pred, prepared[1], prepared[2], shape, self.conf, self.iou, self.max_det)
+
+    def detect(self, prepared, shapes):
+        """Detections per image; shapes are the original (h, w)."""
+        return [self.decode(p, prep, shape) for p, prep, shape in zip(self.infer(prepared), prepared, shapes)]
+
+def make_detector(weights=None, backend=None, imgsz=IMGSZ, batch_size=BATCH_SIZE, conf=CONF, iou=IOU,
+                  threads=None, inter_threads=None):
+    """Detector for a ready backend or weights; models exported with a fixed batch size dictate it."""
+    backend = backend or load_backend(weights or WEIGHTS, threads, inter_threads)
+    if getattr(backend, "batch_size", None) and backend.batch_size != batch_size:
+        print(f"[Info] Model expects batches of {backend.batch_size}, using that instead of {batch_size}.")
+        batch_size = backend.batch_size
+    return Detector(backend, imgsz, batch_size, conf, iou)
+
+def run_inference(input_path, output_dir=None, weights=None, imgsz=IMGSZ, batch_size=BATCH_SIZE, conf=CONF,
+                  iou=IOU, decode_threads=DECODE_THREADS, threads=None, save_crops=True, backend=None,
+                  inter_threads=None):
+    """
+    Streams images through decode/letterbox (thread pool) -> batched CPU inference
+    -> NMS -> JSON + crops (thread pool) and prints throughput and per-stage latency.
+
+    Args:
+        input_path (Path): Image folder, text file with image paths, or extractor output with shards.
+        output_dir (Path): Target folder for `<key>.json` and `crops/`.
+        weights (Path): Trained weights (.pt) or exported model (.onnx) (default: WEIGHTS).
+        threads (int): Intra-op threads of the backend; inter_threads: inter-op threads (ONNX).
+        backend: Ready backend (callable on a float32 NCHW batch), overrides weights.
+
+    Returns:
+        dict: Image count, images/s and mean ms per image for each stage.
+    """
+    output_dir = Path(output_dir or OUTPUT_DIR)
+    (output_dir / "crops").mkdir(parents=True, exist_ok=True)
+    detector = make_detector(weights, backend, imgsz, batch_size, conf, iou, threads, inter_threads)
+    batch_size = detector.batch_size
+
+    times = {"decode": 0.0, "inference": 0.0, "postprocess": 0.0}
+    count, failed = 0, 0
+    start = time.perf_counter()
+    jobs = ((key, loader, imgsz) for key, loader in iter_sources(input_path))
+    with ThreadPoolExecutor(decode_threads) as decoders, ThreadPoolExecutor(WRITE_THREADS) as writers:
+        writes = []
+        batch = []
+
+        def flush():
+            t = time.perf_counter()
+            pred = detector.infer([b[2] for b in batch])
+            times["inference"] += time.perf_counter() - t
+            t = time.perf_counter()
+            for p, (key, img, prepared) in zip(pred, batch):
+                detections = detector.decode(p, prepared, img.shape)
+                writes.append(writers.submit(write_result, output_dir, key, img, detections, save_crops))
+            times["postprocess"] += time.perf_counter() - t
+            batch.clear()
+
+        for key, img, prepared, elapsed in tqdm(_bounded_map(decoders, _decode, jobs, 4 * batch_size), desc="Inference"):
+            times["decode"] += elapsed
+            if img is None:
+                print(f"[Warning] Could not decode {key}, skipping.")
+                failed += 1
+                continue
+            batch.append((key, img, prepared))
+            count += 1
+            if len(batch) == batch_size:
+                flush()
+            # Bound the write queue as well
+            while len(writes) > 4 * batch_size:
+                writes.pop(0).result()
+        if batch:
+            flush()
+        for write in writes:
+            write.result()
+
+    total = time.perf_counter() - start
+    stats = {"images": count, "failed": failed, "seconds": round(total, 2),
+             "images_per_s": round(count / total, 2) if total else 0.0}
+    stats.update({f"{stage}_ms": round(1000 * t / max(count, 1), 2) for stage, t in times.items()})
+    print(f"Done! {count} images in {total:.1f}s ({stats['images_per_s']} img/s), {failed} failed.")
+    print(f"  decode+letterbox {stats['decode_ms']} ms/img (per thread), "
+          f"inference {stats['inference_ms']} ms/img, NMS {stats['postprocess_ms']} ms/img")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Separate compound figures into sub-figure crops (CPU).")
+    parser.add_argument("input", type=Path, help="Image folder, text file of paths, or extractor output folder.")
+    parser.add_argument("--output", type=Path, default=OUTPUT_DIR)
+    parser.add_argument("--weights", type=Path, default=WEIGHTS, help=".pt weights or an exported .onnx model.")
+    parser.add_argument("--imgsz", type=int, default=IMGSZ)
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    parser.add_argument("--conf", type=float, default=CONF)
+    parser.add_argument("--iou", type=float, default=IOU)
+    parser.add_argument("--decode-threads", type=int, default=DECODE_THREADS)
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads of the backend.")
+    parser.add_argument("--inter-threads", type=int, default=None, help="Inter-op threads (ONNX Runtime).")
+    parser.add_argument("--no-crops", action="store_true", help="Only write the detection JSON.")
+    args = parser.parse_args()
+    run_inference(args.input, args.output, args.weights, args.imgsz, args.batch, args.conf, args.iou,
+                  args.decode_threads, args.threads, not args.no_crops, inter_threads=args.inter_threads)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import yaml
+from pathlib import Path
+from sklearn.model_selection import train_test_split
+from tqdm import tqdm
+
+try:
+    from SyntheticCompoundGenerator import LABEL_STUDIO_MAPPING, OUT_IMG_DIR, OUT_LBL_DIR, OUTPUT_FORMAT, OUT_SHARD_DIR
+    from ShardedArchive import ShardReader, has_shards
+except ImportError:  # Imported as utils.DatasetAssembler (notebooks)
+    from utils.SyntheticCompoundGenerator import LABEL_STUDIO_MAPPING, OUT_IMG_DIR, OUT_LBL_DIR, OUTPUT_FORMAT, \
+        OUT_SHARD_DIR
+    from utils.ShardedArchive import ShardReader, has_shards
+
+# --- KONFIGURATION ---
+# 1. Synthetic Data (output of SyntheticCompoundGenerator.py)
+SYNTH_IMG_DIR = OUT_IMG_DIR
+SYNTH_LBL_DIR = OUT_LBL_DIR
+# Read the synthetic samples straight from the generator's tar shards (None: use the folders above)
+SYNTH_SHARD_DIR = OUT_SHARD_DIR if OUTPUT_FORMAT == "shards" else None
+
+# 2. Real Data
+REAL_BASE_DIR = Path("../../dataset/03_intermediate/SCI-3000_real-compound")
+REAL_LBL_DIR = REAL_BASE_DIR / "label-studio_export/labels"
+REAL_IMG_DIRS = [REAL_BASE_DIR, REAL_BASE_DIR / "label-studio_export"]
+
+# --- OUTPUT TARGET ---
+OUTPUT_DIR = Path("../../dataset/04_model_ready")
+MANIFEST_FILE = "assembly_manifest.json"
+# Training samples to leave out (written by PerceptualHashIndex.py: panels leaked into val/test)
+EXCLUSIONS_FILE = "leakage_exclusions.json"
+SPLITS = ["train", "val", "test"]
+
+# --- SPLIT RATIOS (Real Data Only) ---
+VAL_RATIO = 0.15
+TEST_RATIO = 0.15
+SPLIT_SEED = 42
+
+# Oversampling of rare classes in train.txt
+# 4: Legend, 5: Title, 6: X-Axis, 7: Y-Axis
+VERY_RARE_CLASSES = [4, 5, 6, 7]
+RARE_CLASSES = [8]
+VERY_OVERSAMPLE_FACTOR = 25
+RARE_OVERSAMPLE_FACTOR = 5
+
+# Synthetic tables moved to val and test each (real data has almost none)
+TABLE_CLASS = 9
+SYNTH_TABLE_HOLDOUT = 50
+
+# "auto" tries hardlink -> symlink -> copy per file
+LINK_MODE = "auto"
+
+# Image extensions in order of preference
+IMAGE_EXTS = ['.jpg', '.jpeg', '.png', '.JPG', '.PNG']
+# Duplicate stems listed individually before only the count is reported
+MAX_DUPLICATE_WARNINGS = 10
+
+class DirectoryIndex:
+    """
+    stem -> path for the files in a list of directories, built with one os.scandir
+    per directory instead of an exists() call per stem and extension.
+    Earlier directories and extensions win (same order as a sequential search);
+    stems found more than once are reported as warnings.
+    """
+    def __init__(self, search_dirs, extensions=IMAGE_EXTS):
+        self.paths = {}
+        self.signatures = {}  # path -> (mtime_ns, size), from the same scan
+        rank = {ext: i for i, ext in enumerate(extensions)}
+        duplicates = []
+
+        for folder in search_dirs:
+            folder = Path(folder)
+            if not folder.exists(): continue
+            found = {}  # stem -> (rank, DirEntry)
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    stem, ext = os.path.splitext(entry.name)
+                    if ext not in rank or not entry.is_file(): continue
+                    if stem in found:
+                        duplicates.append(f"{folder / stem}.* ({found[stem][1].name}, {entry.name})")
+                        if rank[ext] > found[stem][0]: continue
+                    found[stem] = (rank[ext], entry)
+            for stem, (_, entry) in found.items():
+                if stem in self.paths:
+                    duplicates.append(f"{stem} in {self.paths[stem].parent} and {folder}")
+                    continue
+                st = entry.stat()
+                self.paths[stem] = Path(entry.path)
+                self.signatures[entry.path] = (st.st_mtime_ns, st.st_size)
+
+        for duplicate in duplicates[:MAX_DUPLICATE_WARNINGS]:
+            print(f"[Warning] Duplicate stem, using the first match: {duplicate}")
+        if len(duplicates) > MAX_DUPLICATE_WARNINGS:
+            print(f"[Warning] ... {len(duplicates) - MAX_DUPLICATE_WARNINGS} more duplicate stems.")
+
+    def find(self, stem):
+        return self.paths.get(stem)
+
+    def stems(self):
+        return sorted(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+class ShardMember:
+    """
+    One member of a sample in a tar shard, used in place of a source file path:
+    str() is its stable source id ("<tar path>#<key>.<ext>"), read_bytes() its content.
+    """
+    def __init__(self, reader, key, ext):
+        self.reader = reader
+        self.key = key
+        self.ext = ext
+        self.name = f"{key}.{ext}"
+        self.tar_path = reader.location(key, ext)[0]
+
+    def read_bytes(self):
+        return self.reader.read(self.key, self.ext)
+
+    def __str__(self):
+        return f"{self.tar_path}#{self.name}"
+
+class ShardIndex(DirectoryIndex):
+    """
+    DirectoryIndex over the samples of ShardedArchive shards (key = stem), read
+    from the shard indexes only. Signatures are (shard mtime, member size).
+    """
+    def __init__(self, shard_dir, extensions=IMAGE_EXTS, prefix="shard"):
+        self.paths = {}
+        self.signatures = {}
+        reader = ShardReader(shard_dir, prefix)
+        wanted = list(dict.fromkeys(ext.lstrip(".").lower() for ext in extensions))
+        mtimes = {}
+        for key in reader.keys():
+            members = reader.members(key)
+            ext = next((e for e in wanted if e in members), None)
+            if ext is None: continue
+            member = ShardMember(reader, key, ext)
+            if member.tar_path not in mtimes:
+                mtimes[member.tar_path] = member.tar_path.stat().st_mtime_ns
+            self.paths[key] = member
+            self.signatures[str(member)] = (mtimes[member.tar_path], reader.location(key, ext)[2])
+
+def synth_indexes():
+    """(image index, label index) of the synthetic samples, from shards or folders."""
+    if SYNTH_SHARD_DIR is not None and has_shards(SYNTH_SHARD_DIR):
+        return ShardIndex(SYNTH_SHARD_DIR), ShardIndex(SYNTH_SHARD_DIR, [".txt"])
+    return DirectoryIndex([SYNTH_IMG_DIR]), DirectoryIndex([SYNTH_LBL_DIR], [".txt"])
+
+def read_label_classes(txt_path):
+    """Class ids of all boxes in a YOLO label file or ShardMember (broken lines are ignored)."""
+    classes = []
+    for line in txt_path.read_bytes().decode("utf-8", errors="replace").splitlines():
+        parts = line.split()
+        try:
+            classes.append(int(parts[0]))
+        except (ValueError, IndexError):
+            continue
+    return classes
+
+def scan_real_labels(lbl_index):
+    """One record per real label file with its stratification group (2 = very rare, 1 = rare, 0 = common)."""
+    records = []
+    for stem in tqdm(lbl_index.stems(), desc="Scanning real labels"):
+        if stem == "classes": continue
+        unique_classes = set(read_label_classes(lbl_index.find(stem)))
+        has_very_rare = any(c in VERY_RARE_CLASSES for c in unique_classes)
+        has_rare = any(c in RARE_CLASSES for c in unique_classes)
+        # Tables are too rare to form their own group, they go with the very rare ones
+        if TABLE_CLASS in unique_classes or has_very_rare:
+            stratify_group = 2
+        elif has_rare:
+            stratify_group = 1
+        else:
+            stratify_group = 0
+        records.append({
+            "stem": stem,
+            "stratify_group": stratify_group,
+            "has_very_rare": has_very_rare,
+            "has_rare": has_rare,
+        })
+    return records
+
+def scan_synth_labels(lbl_index):
+    """(table stems, other stems) of the synthetic labels."""
+    tables, others = [], []
+    for stem in tqdm(lbl_index.stems(), desc="Scanning synth labels"):
+        (tables if TABLE_CLASS in read_label_classes(lbl_index.find(stem)) else others).append(stem)
+    return tables, others
+
+def stratified_split(stems, groups, seed=SPLIT_SEED):
+    """
+    Stratified train/val/test split of the real data.
+    Falls back to an unstratified split if a group is too small to be split.
+    """
+    holdout = VAL_RATIO + TEST_RATIO
+    if len(stems) < 3:
+        return {stem: "train" for stem in stems}
+    try:
+        train, rest, _, rest_groups = train_test_split(
+            stems, groups, test_size=holdout, stratify=groups, random_state=seed)
+        val, test = train_test_split(
+            rest, test_size=TEST_RATIO / holdout, stratify=rest_groups, random_state=seed)
+    except ValueError:
+        print(f"[Warning] Groups too small to stratify {len(stems)} new real samples, splitting randomly.")
+        train, rest = train_test_split(stems, test_size=holdout, random_state=seed)
+        val, test = train_test_split(rest, test_size=TEST_RATIO / holdout, random_state=seed)
+    return {**{s: "train" for s in train}, **{s: "val" for s in val}, **{s: "test" for s in test}}
+
+def assign_splits(real_records, synth_tables, synth_others, previous, resplit=False):
+    """
+    Split per sample key ("real/<stem>", "synth/<stem>").
+    Samples keep the split of the previous build (no leakage between splits
+    across rebuilds), only new samples are assigned.
+    """
+    previous = {} if resplit else previous
+    splits = {}
+
+    new_real = [r for r in real_records if f"real/{r['stem']}" not in previous]
+    new_real_splits = stratified_split([r["stem"] for r in new_real], [r["stratify_group"] for r in new_real])
+    for record in real_records:
+        key = f"real/{record['stem']}"
+        splits[key] = previous.get(key) or new_real_splits[record["stem"]]
+
+    # Top up the synthetic table holdout of val and test, everything else trains
+    num_to_move = min(SYNTH_TABLE_HOLDOUT, len(synth_tables) // 3)
+    held_out = {"val": 0, "test": 0}
+    new_tables = []
+    for stem in synth_tables:
+        key = f"synth/{stem}"
+        if key in previous:
+            splits[key] = previous[key]
+            held_out[splits[key]] = held_out.get(splits[key], 0) + 1
+        else:
+            new_tables.append(stem)
+    random.Random(SPLIT_SEED).shuffle(new_tables)
+    for stem in new_tables:
+        split = next((s for s in ("val", "test") if held_out[s] < num_to_move), "train")
+        held_out[split] = held_out.get(split, 0) + 1
+        splits[f"synth/{stem}"] = split
+    for stem in synth_others:
+        splits[f"synth/{stem}"] = previous.get(f"synth/{stem}", "train")
+    return splits
+
+def link_file(src, dst, mode=LINK_MODE):
+    """
+    Places src at dst as hardlink, symlink or copy. "auto" takes the first that
+    works (hardlinks fail across filesystems, symlinks on some mounts).
+    Shard members have no file to link and are always extracted.
+    Returns the method used.
+    """
+    if isinstance(src, ShardMember):
+        Path(dst).write_bytes(src.read_bytes())
+        return "extract"
+    methods = ["hardlink", "symlink", "copy"] if mode == "auto" else [mode]
+    for method in methods:
+        try:
+            if method == "hardlink":
+                os.link(src, dst)
+            elif method == "symlink":
+                os.symlink(Path(src).resolve(), dst)
+            else:
+                shutil.copy2(src, dst)
+            return method
+        except OSError:
+            if method == methods[-1]:
+                raise
+
+def source_signature(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def load_manifest(output_dir):
+    path = Path(output_dir) / MANIFEST_FILE
+    if not path.exists():
+        return {"files": {}, "splits": {}}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def sample_keys(dataset_dir):
+    """Output image path -> assembly sample key ("real/<stem>", "synth/<stem>") from the manifest."""
+    manifest = load_manifest(dataset_dir)
+    synth_roots = [SYNTH_IMG_DIR.resolve()] + ([SYNTH_SHARD_DIR.resolve()] if SYNTH_SHARD_DIR is not None else [])
+    # Same form as the split lists: resolved directory, unresolved (possibly symlinked) file
+    dataset_dir = Path(dataset_dir).resolve()
+    keys = {}
+    for rel, entry in manifest.get("files", {}).items():
+        if not rel.startswith("images/"):
+            continue
+        source = Path(entry["source"]).resolve()
+        origin = "synth" if any(source.is_relative_to(root) for root in synth_roots) else "real"
+        keys[str(dataset_dir / rel)] = f"{origin}/{Path(rel).stem}"
+    return keys
+
+def load_exclusions(output_dir):
+    """Sample keys ("real/<stem>", "synth/<stem>") excluded from the assembly."""
+    path = Path(output_dir) / EXCLUSIONS_FILE
+    if not path.exists():
+        return set()
+    with open(path, 'r') as f:
+        return set(json.load(f).get("exclude", []))
+
+def write_atomic(path, text):
+    tmp_path = Path(f"{path}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def sync_files(output_dir, wanted, manifest, link_mode=LINK_MODE, signatures=None):
+    """
+    Brings output_dir in line with wanted ({relative dest: source path}).
+    Files whose source (path, mtime, size) is unchanged are left alone; stale
+    destinations are removed. Source signatures already known from a
+    DirectoryIndex scan are not stat'ed again.
+    Returns the new file manifest and change counts.
+    """
+    signatures = signatures or {}
+    output_dir = Path(output_dir)
+    old_files = manifest.get("files", {})
+    files = {}
+    counts = {"kept": 0, "linked": 0, "removed": 0}
+
+    for rel in old_files.keys() - wanted.keys():
+        (output_dir / rel).unlink(missing_ok=True)
+        counts["removed"] += 1
+
+    for rel, src in tqdm(sorted(wanted.items()), desc="Linking"):
+        mtime_ns, size = signatures.get(str(src)) or source_signature(src)
+        dst = output_dir / rel
+        old = old_files.get(rel)
+        if old and old["source"] == str(src) and old["mtime_ns"] == mtime_ns and old["size"] == size \
+                and (link_mode in ("auto", old["link"]) or old["link"] == "extract") and os.path.lexists(dst):
+            files[rel] = old
+            counts["kept"] += 1
+            continue
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if os.path.lexists(dst):
+            dst.unlink()
+        method = link_file(src, dst, link_mode)
+        files[rel] = {"source": str(src), "mtime_ns": mtime_ns, "size": size, "link": method}
+        counts["linked"] += 1
+    return files, counts
+
+def write_data_yaml(output_dir):
+    """data.yaml for YOLO, class names from LABEL_STUDIO_MAPPING."""
+    yaml_content = {
+        'path': str(Path(output_dir).resolve()),
+        'train': 'train.txt',
+        'val': 'val.txt',
+        'test': 'test.txt',
+        'names': {item['id']: item['name'] for item in sorted(LABEL_STUDIO_MAPPING, key=lambda item: item['id'])}
+    }
+    write_atomic(Path(output_dir) / "data.yaml", yaml.dump(yaml_content, sort_keys=False))
+
+def assemble_dataset(output_dir=None, link_mode=None, resplit=False):
+    """
+    Assembles (or incrementally updates) the model-ready dataset:
+    images/{split}, labels/{split}, train/val/test.txt (train oversampled) and data.yaml.
+    Samples listed in EXCLUSIONS_FILE are left out.
+
+    Args:
+        output_dir (Path): Target folder (default: OUTPUT_DIR).
+        link_mode (str): "auto", "hardlink", "symlink" or "copy" (default: LINK_MODE).
+        resplit (bool): Draw a new split for all samples instead of keeping the previous one.
+
+    Returns:
+        dict: Number of samples per split.
+    """
+    output_dir = Path(output_dir or OUTPUT_DIR)
+    link_mode = link_mode or LINK_MODE
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(output_dir)
+
+    # One directory scan per source folder, all lookups below go through these
+    real_images = DirectoryIndex(REAL_IMG_DIRS)
+    real_labels = DirectoryIndex([REAL_LBL_DIR], [".txt"])
+    synth_images, synth_labels = synth_indexes()
+    print(f"[Info] Indexed {len(real_images)} real / {len(synth_images)} synthetic images.")
+
+    real_records = scan_real_labels(real_labels)
+    synth_tables, synth_others = scan_synth_labels(synth_labels)
+    splits = assign_splits(real_records, synth_tables, synth_others, manifest.get("splits", {}), resplit)
+
+    sources = {f"real/{r['stem']}": (r["stem"], real_images, real_labels) for r in real_records}
+    sources.update({f"synth/{stem}": (stem, synth_images, synth_labels) for stem in synth_tables + synth_others})
+    # Excluded samples keep their split in the manifest, they are only not linked
+    excluded = load_exclusions(output_dir) & sources.keys()
+    if excluded:
+        print(f"[Info] {len(excluded)} samples excluded by {EXCLUSIONS_FILE}.")
+        for key in excluded:
+            del sources[key]
+
+    # --- DESIRED STATE ---
+    wanted = {}
+    image_paths = {}  # sample key -> absolute image path in the output
+    missing = 0
+    for key, (stem, img_index, lbl_index) in tqdm(sources.items(), desc="Resolving sources"):
+        img_path = img_index.find(stem)
+        lbl_path = lbl_index.find(stem)
+        if img_path is None or lbl_path is None:
+            missing += 1
+            continue
+        split = splits[key]
+        img_rel = f"images/{split}/{img_path.name}"
+        wanted[img_rel] = img_path
+        wanted[f"labels/{split}/{stem}.txt"] = lbl_path
+        # Only the directory is resolved: symlinked images must keep their images/<split>/ path
+        image_paths[key] = str(output_dir.resolve() / img_rel)
+    if missing:
+        print(f"[Warning] {missing} samples without image or label skipped.")
+
+    signatures = {}
+    for index in (real_images, real_labels, synth_images, synth_labels):
+        signatures.update(index.signatures)
+    files, counts = sync_files(output_dir, wanted, manifest, link_mode, signatures)
+
+    # --- MANIFEST FILES ---
+    oversampling = {f"real/{r['stem']}": VERY_OVERSAMPLE_FACTOR if r["has_very_rare"]
+                    else RARE_OVERSAMPLE_FACTOR if r["has_rare"] else 1 for r in real_records}
+    lists = {split: [] for split in SPLITS}
+    for key in sorted(image_paths):
+        split = splits[key]
+        lists[split].extend([image_paths[key]] * (oversampling.get(key, 1) if split == "train" else 1))
+    random.Random(SPLIT_SEED).shuffle(lists["train"])
+    for split in SPLITS:
+        write_atomic(output_dir / f"{split}.txt", '\n'.join(lists[split]))
+    write_data_yaml(output_dir)
+
+    write_atomic(output_dir / MANIFEST_FILE, json.dumps({"link_mode": link_mode, "splits": splits, "files": files}))
+
+    sizes = {split: sum(1 for key in image_paths if splits[key] == split) for split in SPLITS}
+    print(f"Done! {counts['linked']} linked, {counts['kept']} unchanged, {counts['removed']} removed.")
+    for split in SPLITS:
+        print(f"  {split:<5} {sizes[split]:>6} images ({len(lists[split])} entries in {split}.txt)")
+    return sizes
+
+def main():
+    parser = argparse.ArgumentParser(description="Assemble the model-ready YOLO dataset (incremental, link-based).")
+    parser.add_argument("--output", type=Path, default=OUTPUT_DIR)
+    parser.add_argument("--link", choices=["auto", "hardlink", "symlink", "copy"], default=LINK_MODE)
+    parser.add_argument("--resplit", action="store_true", help="Draw a new split instead of keeping the previous one.")
+    parser.add_argument("--cache-imgsz", type=int, default=None,
+                        help="Also letterbox the splits into a memory-mapped training cache at this size.")
+    args = parser.parse_args()
+    assemble_dataset(args.output, args.link, args.resplit)
+    if args.cache_imgsz:
+        from TrainingImageCache import build_training_cache
+        build_training_cache(args.output, args.cache_imgsz)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+from tqdm import tqdm
+import SyntheticCompoundGenerator as gen
+
+# --- KONFIGURATION ---
+NUM_IMAGES = 200           # Images per run
+NUM_ASSETS = 300           # Fixed asset subset (first N asset paths in sorted order)
+WORKER_COUNTS = [1, 2, 4, 8]
+RESULTS_FILE = Path("generator_benchmark.json")
+
+STAGES = ["decode", "resize", "paste", "encode", "image_write", "label_write"]
+
+def fixed_asset_pool(num_assets):
+    """
+    Deterministic asset subset, so runs on different versions draw the same figures.
+    """
+    full = gen.load_asset_sampler({item['name']: item['id'] for item in gen.LABEL_STUDIO_MAPPING})
+    if not full:
+        return None
+    assets = sorted(full.items, key=lambda item: item["path"])[:num_assets]
+    counts = {}
+    for item in assets:
+        counts[item["label"]] = counts.get(item["label"], 0) + 1
+    weights = gen.class_weights(counts)
+    return gen.AliasSampler(assets, [weights[item["label"]] for item in assets])
+
+def redirect_output(out_root):
+    gen.OUT_ROOT = out_root
+    gen.OUT_IMG_DIR = out_root / "images"
+    gen.OUT_LBL_DIR = out_root / "yolo-labels"
+    gen.OUT_IMG_DIR.mkdir(parents=True, exist_ok=True)
+    gen.OUT_LBL_DIR.mkdir(parents=True, exist_ok=True)
+
+def reset_caches():
+    # Every run starts cold (forked workers would otherwise inherit warm caches)
+    gen._asset_cache = gen.AssetCache(gen.ASSET_CACHE_MB * 1024 * 1024)
+    gen._asset_sizes.clear()
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    arr = np.asarray(values) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "mean_ms": float(arr.mean()),
+        "total_s": float(arr.sum() / 1000),
+    }
+
+def run_stage_profile(pool, num_images, seed):
+    """
+    Single process, synchronous writes: every stage of every image is timed.
+    """
+    reset_caches()
+    gen.STAGE_TIMES = {}
+    canvas_pool = gen.CanvasPool(1)
+    per_layout = {}
+
+    start = time.perf_counter()
+    for idx in tqdm(range(num_images), desc="Stage profile"):
+        before = {stage: len(gen.STAGE_TIMES.get(stage, [])) for stage in STAGES}
+        t0 = time.perf_counter()
+        rng = gen.image_rng(idx, seed=seed)
+        task = gen.create_compound(idx, pool, rng=rng, canvas_pool=canvas_pool)
+        elapsed = time.perf_counter() - t0
+        if task is None:
+            continue
+
+        layout = per_layout.setdefault(task["meta"]["layout"], {"total": [], **{s: [] for s in STAGES}})
+        layout["total"].append(elapsed)
+        for stage in STAGES:
+            # Stage time spent on this image (sum over its panels)
+            layout[stage].append(sum(gen.STAGE_TIMES.get(stage, [])[before[stage]:]))
+    wall = time.perf_counter() - start
+
+    stage_times, gen.STAGE_TIMES = gen.STAGE_TIMES, None
+    return {
+        "images_per_s": num_images / wall,
+        "stages": {stage: percentiles(stage_times.get(stage, [])) for stage in STAGES},
+        "cache": gen._asset_cache.stats(),
+        "layouts": {
+            layout: {key: percentiles(values) for key, values in times.items()}
+            for layout, times in sorted(per_layout.items())
+        },
+    }
+
+def run_throughput(pool, num_images, workers, seed):
+    """
+    Full pipeline (worker processes + writer threads), wall clock only.
+    Seed and output folders are passed explicitly, so spawned workers use them too.
+    """
+    reset_caches()
+    process_stats = {}
+    start = time.perf_counter()
+    generated = sum(1 for task in gen.generate_tasks(pool, range(num_images), num_workers=workers,
+                                                      process_stats=process_stats, seed=seed,
+                                                      out_img_dir=gen.OUT_IMG_DIR,
+                                                      out_lbl_dir=gen.OUT_LBL_DIR) if task)
+    wall = time.perf_counter() - start
+    return {
+        "workers": workers,
+        "images": generated,
+        "wall_s": wall,
+        "images_per_s": generated / wall,
+        "peak_rss_mb": max((s["memory"]["peak_rss_mb"] for s in process_stats.values()), default=0.0),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_summary(results):
+    profile = results["stage_profile"]
+    print(f"\n--- STAGES (1 process, {profile['images_per_s']:.1f} images/s) ---")
+    for stage, p in profile["stages"].items():
+        if p["count"]:
+            print(f"  {stage:<12} p50 {p['p50_ms']:7.2f} ms | p95 {p['p95_ms']:7.2f} ms | n={p['count']}")
+    print("\n--- LAYOUTS (per image) ---")
+    for layout, p in profile["layouts"].items():
+        total = p["total"]
+        print(f"  {layout:<4} p50 {total['p50_ms']:7.1f} ms | p95 {total['p95_ms']:7.1f} ms | n={total['count']}")
+    print("\n--- WORKERS ---")
+    for run in results["throughput"]:
+        print(f"  {run['workers']:>2} workers: {run['images_per_s']:6.1f} images/s ({run['wall_s']:.1f}s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SyntheticCompoundGenerator per stage, layout and worker count.")
+    parser.add_argument("--images", type=int, default=NUM_IMAGES)
+    parser.add_argument("--assets", type=int, default=NUM_ASSETS)
+    parser.add_argument("--workers", type=int, nargs="+", default=WORKER_COUNTS)
+    parser.add_argument("--seed", type=int, default=gen.SEED)
+    parser.add_argument("--output", type=Path, default=RESULTS_FILE)
+    args = parser.parse_args()
+
+    pool = fixed_asset_pool(args.assets)
+    if not pool:
+        print("Abort: no assets in the pool.")
+        return
+
+    with tempfile.TemporaryDirectory(prefix="synth_bench_") as tmp:
+        redirect_output(Path(tmp))
+        results = {
+            "config": {
+                "images": args.images, "assets": len(pool), "seed": args.seed,
+                "page_width": gen.PAGE_WIDTH, "asset_pack": gen.get_asset_pack() is not None,
+                "writer_threads": gen.WRITER_THREADS, "reuse_canvas_buffers": gen.REUSE_CANVAS_BUFFERS,
+                "git_revision": git_revision(), "python": platform.python_version(),
+                "machine": platform.machine(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "stage_profile": run_stage_profile(pool, args.images, args.seed),
+            "throughput": [run_throughput(pool, args.images, w, args.seed) for w in args.workers],
+        }
+
+    print_summary(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import argparse
+import json
+import re
+import shutil
+import time
+import cv2
+import numpy as np
+import onnx
+from pathlib import Path
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static
+from onnxruntime.quantization.shape_inference import quant_pre_process
+from tqdm import tqdm
+
+try:
+    from CompoundInference import WEIGHTS, BATCH_SIZE, Detector, OnnxBackend, prepare, to_batch
+    from DatasetAssembler import OUTPUT_DIR, sample_keys
+    from TrainingImageCache import read_split_list, read_yolo_labels, label_path_for
+except ImportError:  # Imported as utils.OnnxDeployment (notebooks)
+    from utils.CompoundInference import WEIGHTS, BATCH_SIZE, Detector, OnnxBackend, prepare, to_batch
+    from utils.DatasetAssembler import OUTPUT_DIR, sample_keys
+    from utils.TrainingImageCache import read_split_list, read_yolo_labels, label_path_for
+
+# --- KONFIGURATION ---
+BENCHMARK_FILE = Path("../../runs/detect/onnx_cpu_benchmark.json")
+SIZES = [640, 960]
+CALIBRATION_IMAGES = 200                 # Real val images for the INT8 activation ranges
+CALIBRATION_METHOD = "MinMax"            # "MinMax", "Entropy" or "Percentile"
+# Evaluation like ultralytics val: low confidence threshold, IoU 0.50:0.95
+EVAL_CONF = 0.001
+EVAL_IOU = 0.7
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+LATENCY_RUNS = 20
+WARMUP_RUNS = 3
+
+def model_path(weights, imgsz, batch_size, precision):
+    """Exports live next to the weights: best_960_b8_fp32.onnx, best_960_b8_int8.onnx, ..."""
+    weights = Path(weights or WEIGHTS)
+    return weights.with_name(f"{weights.stem}_{imgsz}_b{batch_size}_{precision}.onnx")
+
+def export_onnx(weights=None, imgsz=960, batch_size=BATCH_SIZE):
+    """Exports the trained weights to ONNX with a static input of (batch_size, 3, imgsz, imgsz)."""
+    from ultralytics import YOLO
+    target = model_path(weights, imgsz, batch_size, "fp32")
+    exported = YOLO(str(weights or WEIGHTS)).export(format="onnx", imgsz=imgsz, batch=batch_size,
+                                                    dynamic=False, simplify=True, device="cpu")
+    # ultralytics writes <weights>.onnx, one file per size keeps the exports apart
+    shutil.move(exported, target)
+    print(f"[Info] Exported {target}")
+    return target
+
+def real_split_images(dataset_dir, split):
+    """Images of a split list that come from the real (annotated) data, not the generator."""
+    keys = sample_keys(dataset_dir)
+    paths = read_split_list(dataset_dir, split)
+    real = [path for path in paths if keys.get(path, "").startswith("real/")]
+    if not real:
+        print(f"[Warning] No real images found for {split} in the assembly manifest.")
+    return real
+
+class ValCalibrationReader(CalibrationDataReader):
+    """Feeds letterboxed real val images to the INT8 calibration, in the model's batch size."""
+    def __init__(self, input_name, image_paths, imgsz, batch_size):
+        self.input_name = input_name
+        self.image_paths = image_paths
+        self.imgsz = imgsz
+        self.batch_size = batch_size
+        self._batches = self._iter_batches()
+
+    def _iter_batches(self):
+        tensors = []
+        for path in tqdm(self.image_paths, desc="Calibrating"):
+            img = cv2.imread(path)
+            if img is None:
+                continue
+            tensors.append(prepare(img, self.imgsz)[0])
+            if len(tensors) == self.batch_size:
+                yield {self.input_name: to_batch(tensors)}
+                tensors = []
+        # A static model cannot take a short last batch, it is dropped
+
+    def get_next(self):
+        return next(self._batches, None)
+
+    def rewind(self):
+        self._batches = self._iter_batches()
+
+def head_nodes(model):
+    """
+    Non-Conv nodes of the Detect head (last "/model.N/" module) and the DFL module
+    with its fixed-weight Conv: box decoding (DFL, anchors, concat) needs the full
+    float range and stays FP32.
+    Node names of an ultralytics export look like "/model.23/dfl/Reshape".
+    """
+    modules = [match.group(1) for match in (re.match(r"/model\.(\d+)/", node.name) for node in model.graph.node)
+               if match]
+    if not modules:
+        print("[Warning] No /model.N/ nodes found, the whole model is quantized.")
+        return []
+    head = f"/model.{max(int(n) for n in modules)}/"
+    return [node.name for node in model.graph.node
+            if node.name.startswith(head) and (node.op_type != "Conv" or node.name.startswith(f"{head}dfl/"))]
+
+def quantize_int8(fp32_path, dataset_dir=None, num_images=CALIBRATION_IMAGES, method=CALIBRATION_METHOD):
+    """
+    Static INT8 quantization (QDQ, per-channel weights) of an exported model,
+    calibrated on real val images. Returns the path of the INT8 model.
+    """
+    fp32_path = Path(fp32_path)
+    prep_path = fp32_path.with_name(fp32_path.stem + "_prep.onnx")
+    int8_path = fp32_path.with_name(fp32_path.stem.replace("_fp32", "_int8") + ".onnx")
+    quant_pre_process(str(fp32_path), str(prep_path))
+
+    model = onnx.load(str(prep_path))
+    model_input = model.graph.input[0]
+    batch_size, _, imgsz, _ = (d.dim_value for d in model_input.type.tensor_type.shape.dim)
+    images = real_split_images(Path(dataset_dir or OUTPUT_DIR), "val")[:num_images]
+    reader = ValCalibrationReader(model_input.name, images, imgsz, batch_size)
+
+    quantize_static(
+        str(prep_path), str(int8_path), reader,
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        calibrate_method=getattr(CalibrationMethod, method),
+        nodes_to_exclude=head_nodes(model),
+    )
+    prep_path.unlink()
+    print(f"[Info] Quantized {int8_path} ({len(images)} calibration images)")
+    return int8_path
+
+def box_iou(a, b):
+    """IoU matrix of (N, 4) and (M, 4) boxes in x0, y0, x1, y1."""
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+def match_predictions(pred_boxes, pred_cls, gt_boxes, gt_cls):
+    """(N predictions, thresholds) bool: true positive at each IoU threshold (one match per box)."""
+    correct = np.zeros((len(pred_boxes), len(IOU_THRESHOLDS)), dtype=bool)
+    if not len(pred_boxes) or not len(gt_boxes):
+        return correct
+    iou = box_iou(gt_boxes, pred_boxes) * (gt_cls[:, None] == pred_cls[None, :])
+    for t, threshold in enumerate(IOU_THRESHOLDS):
+        gt_idx, pred_idx = np.nonzero(iou >= threshold)
+        if not len(gt_idx):
+            continue
+        order = np.argsort(-iou[gt_idx, pred_idx], kind="stable")
+        gt_idx, pred_idx = gt_idx[order], pred_idx[order]
+        _, first = np.unique(pred_idx, return_index=True)
+        gt_idx, pred_idx = gt_idx[first], pred_idx[first]
+        order = np.argsort(-iou[gt_idx, pred_idx], kind="stable")
+        _, first = np.unique(gt_idx[order], return_index=True)
+        correct[pred_idx[order][first], t] = True
+    return correct
+
+def average_precision(recall, precision):
+    """Area under the interpolated PR curve (101 points, as in COCO/ultralytics)."""
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return np.trapezoid(np.interp(x, mrec, mpre), x)
+
+def mean_average_precision(correct, confidences, pred_cls, gt_cls):
+    """(mAP50, mAP50-95) over the classes that occur in the ground truth."""
+    order = np.argsort(-confidences, kind="stable")
+    correct, pred_cls = correct[order], pred_cls[order]
+    ap = []
+    for cls in np.unique(gt_cls):
+        hits = correct[pred_cls == cls]
+        n_gt = int((gt_cls == cls).sum())
+        if not len(hits):
+            ap.append(np.zeros(len(IOU_THRESHOLDS)))
+            continue
+        tp = np.cumsum(hits, axis=0)
+        fp = np.cumsum(~hits, axis=0)
+        recall = tp / n_gt
+        precision = tp / (tp + fp)
+        ap.append([average_precision(recall[:, t], precision[:, t]) for t in range(len(IOU_THRESHOLDS))])
+    if not ap:
+        return 0.0, 0.0
+    ap = np.array(ap)
+    return float(ap[:, 0].mean()), float(ap.mean())
+
+def evaluate(detector, image_paths):
+    """mAP50 and mAP50-95 of a detector on images with YOLO labels."""
+    correct, confidences, pred_cls, gt_cls = [], [], [], []
+    batch = []
+
+    def flush():
+        detections = detector.detect([prepared for prepared, _, _ in batch], [shape for _, shape, _ in batch])
+        for (_, _, gt), dets in zip(batch, detections):
+            boxes = np.array([d["bbox"] for d in dets], dtype=np.float64).reshape(-1, 4)
+            classes = np.array([d["class_id"] for d in dets], dtype=int)
+            correct.append(match_predictions(boxes, classes, gt[:, 1:], gt[:, 0].astype(int)))
+            confidences.append(np.array([d["confidence"] for d in dets]))
+            pred_cls.append(classes)
+            gt_cls.append(gt[:, 0].astype(int))
+        batch.clear()
+
+    for path in tqdm(image_paths, desc="Evaluating"):
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        h, w = img.shape[:2]
+        labels = read_yolo_labels(label_path_for(path)).astype(np.float64)
+        cx, cy, bw, bh = labels[:, 1] * w, labels[:, 2] * h, labels[:, 3] * w, labels[:, 4] * h
+        gt = np.stack([labels[:, 0], cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+        batch.append((prepare(img, detector.imgsz), img.shape, gt))
+        if len(batch) == detector.batch_size:
+            flush()
+    if batch:
+        flush()
+    if not correct:
+        return 0.0, 0.0
+    return mean_average_precision(np.concatenate(correct), np.concatenate(confidences),
+                                  np.concatenate(pred_cls), np.concatenate(gt_cls))
+
+def measure_latency(backend, batch_size, imgsz, runs=LATENCY_RUNS):
+    """Per-batch latencies (ms) of the backend alone, after warmup."""
+    batch = np.random.default_rng(0).random((batch_size, 3, imgsz, imgsz), dtype=np.float32)
+    for _ in range(WARMUP_RUNS):
+        backend(batch)
+    latencies = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        backend(batch)
+        latencies.append(1000 * (time.perf_counter() - t))
+    return np.array(latencies)
+
+def run_benchmark(weights=None, dataset_dir=None, sizes=None, batch_size=BATCH_SIZE, threads=None,
+                  inter_threads=None, int8=True, evaluate_map=True):
+    """
+    Exports (if missing) and optionally quantizes the model per input size, then
+    compares FP32 and INT8 in ONNX Runtime: latency, throughput and mAP on the
+    real test split. Results are printed and saved to BENCHMARK_FILE.
+    """
+    dataset_dir = Path(dataset_dir or OUTPUT_DIR)
+    test_images = real_split_images(dataset_dir, "test") if evaluate_map else []
+    results = []
+    for imgsz in sizes or SIZES:
+        fp32_path = model_path(weights, imgsz, batch_size, "fp32")
+        if not fp32_path.exists():
+            export_onnx(weights, imgsz, batch_size)
+        models = {"fp32": fp32_path}
+        if int8:
+            int8_path = model_path(weights, imgsz, batch_size, "int8")
+            models["int8"] = int8_path if int8_path.exists() else quantize_int8(fp32_path, dataset_dir)
+
+        for precision, path in models.items():
+            backend = OnnxBackend(path, threads, inter_threads)
+            latencies = measure_latency(backend, batch_size, imgsz)
+            result = {
+                "imgsz": imgsz, "precision": precision, "batch_size": batch_size,
+                "threads": threads, "inter_threads": inter_threads,
+                "batch_ms_p50": round(float(np.percentile(latencies, 50)), 2),
+                "batch_ms_p90": round(float(np.percentile(latencies, 90)), 2),
+                "ms_per_image": round(float(np.median(latencies)) / batch_size, 2),
+                "images_per_s": round(1000 * batch_size / float(np.median(latencies)), 2),
+                "model_mb": round(path.stat().st_size / 1024**2, 1),
+            }
+            if evaluate_map:
+                detector = Detector(backend, imgsz, batch_size, EVAL_CONF, EVAL_IOU)
+                result["mAP50"], result["mAP50-95"] = (round(v, 4) for v in evaluate(detector, test_images))
+            results.append(result)
+
+    print(f"\n{'imgsz':>5} {'prec':<5} {'ms/img':>7} {'img/s':>7} {'p90 ms/batch':>12} {'MB':>6} {'mAP50-95':>8}")
+    for r in results:
+        print(f"{r['imgsz']:>5} {r['precision']:<5} {r['ms_per_image']:>7} {r['images_per_s']:>7} "
+              f"{r['batch_ms_p90']:>12} {r['model_mb']:>6} {r.get('mAP50-95', '-'):>8}")
+    BENCHMARK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(BENCHMARK_FILE, "w") as f:
+        json.dump({"test_images": len(test_images), "results": results}, f, indent=4)
+    print(f"Done! Results saved to {BENCHMARK_FILE}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Export to ONNX, quantize to INT8 and benchmark on the CPU.")
+    parser.add_argument("--weights", type=Path, default=WEIGHTS)
+    parser.add_argument("--dataset", type=Path, default=OUTPUT_DIR)
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="Static batch size of the export.")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads.")
+    parser.add_argument("--inter-threads", type=int, default=None, help="Inter-op threads.")
+    parser.add_argument("--no-int8", action="store_true", help="Only benchmark the FP32 export.")
+    parser.add_argument("--no-eval", action="store_true", help="Skip mAP on the real test split.")
+    args = parser.parse_args()
+    run_benchmark(args.weights, args.dataset, args.sizes, args.batch, args.threads, args.inter_threads,
+                  not args.no_int8, not args.no_eval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import os
+import re
+import struct
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+
+# Default disk budget for cached page rasters
+CACHE_MAX_GB = 20
+# Fill level (of the budget) eviction brings the cache down to
+EVICT_TO = 0.9
+
+_HEADER = struct.Struct("<4sIIII")  # magic, width, height, components, alpha
+_MAGIC = b"PRC1"
+
+class PageRasterCache:
+    """
+    Disk cache of full rendered pages, keyed by (pdf_id, page number, DPI).
+
+    A page is rendered once, at the highest DPI its figures need (cache_dpi); figure
+    crops are cut from the cached raster instead of rendering the page again with
+    get_pixmap(clip=...), and crops at a lower DPI are resampled from it. Entries are
+    raw, uncompressed samples (fast to load, large: ~25 MB per A4 page at 300 DPI).
+    The cache is bounded by max_bytes; the least recently used entries (by mtime,
+    touched on every hit) are evicted first. Several processes may share one
+    directory: files are written atomically and each process tracks an estimate
+    of the total size, rescanning the directory only when it exceeds the budget.
+    """
+    def __init__(self, cache_dir, max_bytes=CACHE_MAX_GB * 1024**3):
+        self.cache_dir = str(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = sum(size for _, _, size in self._entries())
+        self._current = None  # (key, pixmap) of the last page, figures of one page share it
+
+    def _path(self, pdf_id, page_nr, dpi):
+        return os.path.join(self.cache_dir, f"{pdf_id}-{page_nr}-{dpi}dpi.raw")
+
+    def _entries(self):
+        with os.scandir(self.cache_dir) as entries:
+            return [(e.path, e.stat().st_mtime_ns, e.stat().st_size)
+                    for e in entries if e.name.endswith(".raw") and e.is_file()]
+
+    def get(self, pdf_id, page_nr, dpi):
+        """The cached page pixmap, or None."""
+        key = (pdf_id, page_nr, dpi)
+        if self._current is not None and self._current[0] == key:
+            return self._current[1]
+        path = self._path(*key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        magic, w, h, n, alpha = _HEADER.unpack_from(data)
+        if magic != _MAGIC or len(data) != _HEADER.size + w * h * n:
+            return None
+        os.utime(path)  # LRU: mark as recently used
+        colorspace = {1: fitz.csGRAY, 3: fitz.csRGB, 4: fitz.csCMYK}[n - alpha]
+        pix = fitz.Pixmap(colorspace, w, h, data[_HEADER.size:], bool(alpha))
+        self._current = (key, pix)
+        return pix
+
+    def put(self, pdf_id, page_nr, dpi, pix):
+        key = (pdf_id, page_nr, dpi)
+        path = self._path(*key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, pix.width, pix.height, pix.n, int(pix.alpha)))
+            f.write(pix.samples)
+        os.replace(tmp_path, path)
+        self._current = (key, pix)
+        self._size += _HEADER.size + len(pix.samples)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache is below EVICT_TO of its budget."""
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        self._size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self._size <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Evicted by another process
+            self._size -= size
+
+    def page_pixmap(self, page, pdf_id, dpi):
+        """The full page rendered at dpi, from the cache or rendered (and cached)."""
+        page_nr = page.number + 1
+        pix = self.get(pdf_id, page_nr, dpi)
+        if pix is not None:
+            self.hits += 1
+            return pix
+        self.misses += 1
+        pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+        self.put(pdf_id, page_nr, dpi, pix)
+        return pix
+
+    def crop(self, page, pdf_id, dpi, clip, cache_dpi=None):
+        """
+        Same pixels as page.get_pixmap(matrix=dpi/72, clip=clip), cut from the page raster
+        (anti-aliasing can differ on single pixels where the clip edge crosses content).
+
+        The page is cached at cache_dpi (default: dpi), so figures rendered at different
+        DPIs (pixel budget) share one raster. Below cache_dpi, the crop is area-resampled
+        to the size get_pixmap would return at dpi, which is close to but not exactly a
+        direct render (text edges are slightly softer).
+        """
+        cache_dpi = max(dpi, cache_dpi or dpi)
+        full = self.page_pixmap(page, pdf_id, cache_dpi)
+        irect = (clip * fitz.Matrix(cache_dpi / 72, cache_dpi / 72)).irect & full.irect
+        pix = fitz.Pixmap(full.colorspace, irect, full.alpha)
+        pix.copy(full, irect)
+        if cache_dpi == dpi:
+            return pix
+
+        page_rect = (page.rect * fitz.Matrix(dpi / 72, dpi / 72)).irect
+        target = (clip * fitz.Matrix(dpi / 72, dpi / 72)).irect & page_rect
+        if irect.is_empty or target.is_empty:
+            return fitz.Pixmap(full.colorspace, target, full.alpha)
+        samples = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+        resized = cv2.resize(samples, (target.width, target.height), interpolation=cv2.INTER_AREA)
+        return fitz.Pixmap(full.colorspace, target.width, target.height,
+                           np.ascontiguousarray(resized).tobytes(), full.alpha)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size_mb": self._size / 1024**2}
+
+def clear_page_cache(cache_dir, pdf_id=None):
+    """Deletes all cached pages, or only those of one PDF."""
+    pattern = re.compile(rf"{re.escape(pdf_id)}-\d+-\d+dpi\.raw$") if pdf_id else None
+    removed = 0
+    with os.scandir(cache_dir) as entries:
+        for e in entries:
+            if e.name.endswith(".raw") and (pattern is None or pattern.match(e.name)):
+                os.remove(e.path)
+                removed += 1
+    return removed
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import cv2
+import numpy as np
+from multiprocessing import Pool
+from pathlib import Path
+from tqdm import tqdm
+
+try:
+    from DatasetAssembler import OUTPUT_DIR, SPLITS, EXCLUSIONS_FILE, sample_keys
+    from SyntheticCompoundGenerator import ASSET_DIR, JSON_INPUT_PATH
+    from TrainingImageCache import read_split_list, read_yolo_labels, label_path_for
+except ImportError:  # Imported as utils.PerceptualHashIndex (notebooks)
+    from utils.DatasetAssembler import OUTPUT_DIR, SPLITS, EXCLUSIONS_FILE, sample_keys
+    from utils.SyntheticCompoundGenerator import ASSET_DIR, JSON_INPUT_PATH
+    from utils.TrainingImageCache import read_split_list, read_yolo_labels, label_path_for
+
+# --- KONFIGURATION ---
+HASH_FILE = "phash_index.npz"      # In the dataset folder
+# Boxes hashed as panels (shared legends/titles/axes are mostly text and match everything)
+PANEL_CLASSES = [0, 1, 2, 3, 8, 9, 10]
+RADIUS = 5                         # Max. Hamming distance (of 64 bits) for a near-duplicate
+MIN_SIDE = 24                      # Smaller crops are skipped (px)
+MIN_STD = 3.0                      # Nearly uniform crops (blank panels) hash to noise
+CHUNK_SIZE = 32                    # Images per worker task
+
+# Origins of hashed crops; assets are the single figures the synthetic compounds are built from
+ORIGINS = ["asset"] + SPLITS
+
+def dhash(img):
+    """64-bit difference hash of a BGR or gray image, None if the image is nearly uniform."""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    if gray.std() < MIN_STD:
+        return None
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def _hash_image(job):
+    """Hashes of the panel boxes of one image (or the whole image if boxes is None)."""
+    path, with_boxes = job
+    img = cv2.imread(str(path))
+    if img is None:
+        return path, None
+    h, w = img.shape[:2]
+    if not with_boxes:
+        value = dhash(img) if min(h, w) >= MIN_SIDE else None
+        return path, [] if value is None else [(-1, value)]
+
+    results = []
+    for box_idx, (cls, cx, cy, bw, bh) in enumerate(read_yolo_labels(label_path_for(path))):
+        if int(cls) not in PANEL_CLASSES:
+            continue
+        x0, x1 = max(0, round((cx - bw / 2) * w)), min(w, round((cx + bw / 2) * w))
+        y0, y1 = max(0, round((cy - bh / 2) * h)), min(h, round((cy + bh / 2) * h))
+        if min(x1 - x0, y1 - y0) < MIN_SIDE:
+            continue
+        value = dhash(img[y0:y1, x0:x1])
+        if value is not None:
+            results.append((box_idx, value))
+    return path, results
+
+class MultiIndexHash:
+    """
+    Radius search over 64-bit hashes (multi-index hashing).
+    The hash is cut into radius + 1 chunks; by the pigeonhole principle two hashes
+    within the radius agree exactly on at least one chunk, so only hashes sharing
+    a chunk value are compared (vectorized popcount).
+    """
+    def __init__(self, hashes, radius=RADIUS):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.radius = radius
+        bounds = np.linspace(0, 64, radius + 2).astype(int)
+        self._chunks = list(zip(bounds[:-1], bounds[1:]))
+        self._tables = []
+        for lo, hi in self._chunks:
+            values = self._chunk(self.hashes, lo, hi)
+            order = np.argsort(values, kind="stable")
+            keys, starts = np.unique(values[order], return_index=True)
+            ends = np.append(starts[1:], len(order))
+            self._tables.append({int(k): order[s:e] for k, s, e in zip(keys, starts, ends)})
+
+    @staticmethod
+    def _chunk(values, lo, hi):
+        return (values >> np.uint64(lo)) & np.uint64((1 << (hi - lo)) - 1)
+
+    def query(self, value):
+        """(indices, distances) of all stored hashes within the radius of value."""
+        value = np.uint64(value)
+        candidates = [table.get(int(self._chunk(value, lo, hi)))
+                      for (lo, hi), table in zip(self._chunks, self._tables)]
+        candidates = [c for c in candidates if c is not None]
+        if not candidates:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        candidates = np.unique(np.concatenate(candidates))
+        distances = np.bitwise_count(self.hashes[candidates] ^ value).astype(np.int64)
+        keep = distances <= self.radius
+        return candidates[keep], distances[keep]
+
+def list_assets(asset_dir=None, labels_path=None):
+    asset_dir = Path(asset_dir or ASSET_DIR)
+    labels_path = Path(labels_path or JSON_INPUT_PATH)
+    if not labels_path.exists():
+        print(f"[Warning] {labels_path} not found, assets are not hashed.")
+        return []
+    with open(labels_path, 'r') as f:
+        names = list(json.load(f))
+    return [asset_dir / name for name in names if (asset_dir / name).exists()]
+
+def build_hash_index(dataset_dir=None, asset_dir=None, labels_path=None, num_workers=None):
+    """
+    Hashes the panel boxes of every image in the split lists and every single
+    figure asset, and saves them to `<dataset>/phash_index.npz`.
+
+    Returns:
+        dict: Arrays hash (uint64), origin (index into ORIGINS), image (index into
+            paths), box (label line, -1 for whole assets) and the list of paths.
+    """
+    dataset_dir = Path(dataset_dir or OUTPUT_DIR)
+    jobs, job_origins = [], []
+    for origin, split in enumerate(SPLITS, start=1):
+        paths = read_split_list(dataset_dir, split)
+        jobs += [(path, True) for path in paths]
+        job_origins += [origin] * len(paths)
+    assets = list_assets(asset_dir, labels_path)
+    jobs += [(str(path), False) for path in assets]
+    job_origins += [0] * len(assets)
+    print(f"[Info] Hashing {len(jobs) - len(assets)} dataset images and {len(assets)} assets.")
+
+    paths, hashes, origins, images, boxes = [], [], [], [], []
+    failed = 0
+    with Pool(num_workers or os.cpu_count()) as workers:
+        results = workers.imap(_hash_image, jobs, chunksize=CHUNK_SIZE)
+        for origin, (path, crops) in tqdm(zip(job_origins, results), total=len(jobs), desc="Hashing"):
+            if crops is None:
+                failed += 1
+                continue
+            image_idx = len(paths)
+            paths.append(str(path))
+            for box_idx, value in crops:
+                hashes.append(value)
+                origins.append(origin)
+                images.append(image_idx)
+                boxes.append(box_idx)
+    if failed:
+        print(f"[Warning] {failed} images could not be decoded.")
+
+    index = {
+        "hash": np.array(hashes, dtype=np.uint64),
+        "origin": np.array(origins, dtype=np.int8),
+        "image": np.array(images, dtype=np.int32),
+        "box": np.array(boxes, dtype=np.int16),
+        "paths": np.array(paths, dtype=str),
+    }
+    np.savez(dataset_dir / HASH_FILE, **index)
+    print(f"Done! {len(hashes)} crop hashes saved to {dataset_dir / HASH_FILE}.")
+    return index
+
+def load_hash_index(dataset_dir=None):
+    with np.load(Path(dataset_dir or OUTPUT_DIR) / HASH_FILE) as data:
+        return {name: data[name] for name in data.files}
+
+def find_leaks(index, radius=RADIUS):
+    """
+    Near-duplicate crops between a held-out split (val, test) and everything the
+    model learns from (train crops and synthetic assets), plus val <-> test.
+
+    Returns:
+        list: (held-out crop, reference crop, distance) index triples into the index arrays.
+    """
+    origin = index["origin"]
+    train, val, test = (ORIGINS.index(s) for s in SPLITS)
+    reference = np.flatnonzero((origin == train) | (origin == ORIGINS.index("asset")) | (origin == val))
+    tree = MultiIndexHash(index["hash"][reference], radius)
+
+    leaks = []
+    for crop in tqdm(np.flatnonzero((origin == val) | (origin == test)), desc="Querying"):
+        found, distances = tree.query(index["hash"][crop])
+        for ref, distance in zip(reference[found], distances):
+            # val is only a reference for test crops
+            if origin[ref] == val and origin[crop] == val:
+                continue
+            leaks.append((int(crop), int(ref), int(distance)))
+    return leaks
+
+def leakage_report(index, leaks, dataset_dir=None, reset=False):
+    """
+    Prints leak counts per split pair and writes the exclusion list: training samples
+    (left out by DatasetAssembler.py) and assets (left out of the synthetic generator's
+    pool) that share a panel with val/test.
+
+    The list only grows: entries of an existing file are kept, since excluded samples
+    are no longer in the dataset and would not be found again. reset starts a new list.
+    """
+    dataset_dir = Path(dataset_dir or OUTPUT_DIR)
+    origin, images, paths = index["origin"], index["image"], index["paths"]
+    keys = sample_keys(dataset_dir)
+    train, asset = ORIGINS.index("train"), ORIGINS.index("asset")
+
+    pair_counts = {}
+    held_out_images = set()
+    exclude, assets = set(), set()
+    for crop, ref, _ in leaks:
+        pair = (ORIGINS[origin[ref]], ORIGINS[origin[crop]])
+        pair_counts[pair] = pair_counts.get(pair, 0) + 1
+        held_out_images.add(images[crop])
+        ref_path = paths[images[ref]]
+        if origin[ref] == train and ref_path in keys:
+            exclude.add(keys[ref_path])
+        elif origin[ref] == asset:
+            assets.add(Path(ref_path).name)
+
+    unique, counts = np.unique(index["hash"], return_counts=True)
+    print(f"[Info] {len(index['hash'])} crops, {int((counts > 1).sum())} hashes shared by several crops.")
+    for (ref_origin, crop_origin), n in sorted(pair_counts.items()):
+        print(f"  {ref_origin:<5} -> {crop_origin:<5} {n:>7} near-duplicate crop pairs")
+    print(f"[Info] {len(held_out_images)} held-out images affected, {len(exclude)} training samples "
+          f"and {len(assets)} assets to exclude.")
+
+    exclusions_path = dataset_dir / EXCLUSIONS_FILE
+    if exclusions_path.exists() and not reset:
+        with open(exclusions_path, 'r') as f:
+            old = json.load(f)
+        known = len(old.get("exclude", [])) + len(old.get("assets", []))
+        exclude.update(old.get("exclude", []))
+        assets.update(old.get("assets", []))
+        print(f"[Info] Merged with {known} existing exclusions (--reset to start over).")
+
+    exclusions = {"exclude": sorted(exclude), "assets": sorted(assets)}
+    with open(exclusions_path, "w") as f:
+        json.dump(exclusions, f, indent=4)
+    print(f"Done! Exclusion list written to {dataset_dir / EXCLUSIONS_FILE}")
+    return exclusions
+
+def main():
+    parser = argparse.ArgumentParser(description="Perceptual-hash leakage check between train/assets and val/test.")
+    parser.add_argument("--dataset", type=Path, default=OUTPUT_DIR)
+    parser.add_argument("--assets", type=Path, default=ASSET_DIR)
+    parser.add_argument("--asset-labels", type=Path, default=JSON_INPUT_PATH)
+    parser.add_argument("--radius", type=int, default=RADIUS)
+    parser.add_argument("--rebuild", action="store_true", help="Hash again instead of loading the saved index.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--reset", action="store_true", help="Replace the exclusion list instead of extending it.")
+    args = parser.parse_args()
+
+    if args.rebuild or not (args.dataset / HASH_FILE).exists():
+        index = build_hash_index(args.dataset, args.assets, args.asset_labels, args.workers)
+    else:
+        index = load_hash_index(args.dataset)
+    leakage_report(index, find_leaks(index, args.radius), args.dataset, args.reset)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import sqlite3
+from multiprocessing import Pool
+from pathlib import Path
+from tqdm import tqdm
+
+# --- KONFIGURATION ---
+ANNOTATIONS_DIR = Path("../../data_links/data/SCI-3000/Annotations")
+INDEX_PATH = Path("../../dataset/raw/SCI-3000-annotations.sqlite")
+# Stored as PRAGMA user_version; an index with an older schema is rebuilt from scratch
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    page_id       TEXT PRIMARY KEY,
+    pdf_id        TEXT NOT NULL,
+    page_nr       INTEGER NOT NULL,
+    canvas_width  REAL,
+    canvas_height REAL,
+    mtime_ns      INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS annotations (
+    page_id       TEXT NOT NULL REFERENCES pages(page_id) ON DELETE CASCADE,
+    position      INTEGER NOT NULL,
+    annotation_id TEXT,
+    kind          TEXT,
+    is_figure     INTEGER NOT NULL,
+    is_caption    INTEGER NOT NULL,
+    parent        TEXT,
+    x REAL, y REAL, w REAL, h REAL,
+    x0_rel REAL, y0_rel REAL, x1_rel REAL, y1_rel REAL,
+    PRIMARY KEY (page_id, position)
+);
+CREATE INDEX IF NOT EXISTS annotations_kind ON annotations(kind, page_id);
+CREATE INDEX IF NOT EXISTS annotations_figure ON annotations(is_figure, page_id);
+CREATE INDEX IF NOT EXISTS pages_pdf ON pages(pdf_id);
+"""
+
+def parse_selector(selector):
+    """'xywh=pixel:136,141,748,353' -> (136.0, 141.0, 748.0, 353.0), None without pixel coordinates."""
+    if "pixel:" not in selector:
+        return None
+    x, y, w, h = map(float, selector.split("pixel:")[1].split(","))
+    return x, y, w, h
+
+def parse_page_annotations(data):
+    """
+    Flattens the annotations of one SCI-3000 page JSON.
+
+    Returns:
+        list: One dict per annotation (in file order) with annotation_id,
+            is_figure / is_caption (any body value is 'Figure' / 'Caption'), kind
+            ('Figure', 'Caption' or else the first body value), parent (annotation id
+            of the figure a caption belongs to) and rect (x, y, w, h in canvas pixels,
+            None if the selector has no pixel coordinates). Annotations without a
+            body list are dropped.
+    """
+    records = []
+    for anno in data.get("annotations", []):
+        body_list = anno.get("body", [])
+        if not isinstance(body_list, list): continue
+
+        values = [item.get("value") for item in body_list if item.get("purpose") != "parent"]
+        parent_id = None
+        for item in body_list:
+            if item.get("purpose") == "parent":
+                parent_id = item.get("value")
+        is_figure = any(item.get("value") == "Figure" for item in body_list)
+        is_caption = any(item.get("value") == "Caption" for item in body_list)
+
+        selector = anno.get("target", {}).get("selector", {}).get("value", "")
+        records.append({
+            "annotation_id": anno.get("id"),
+            "kind": "Figure" if is_figure else "Caption" if is_caption else values[0] if values else None,
+            "is_figure": is_figure,
+            "is_caption": is_caption,
+            "parent": parent_id,
+            "rect": parse_selector(selector),
+        })
+    return records
+
+def page_id_parts(page_id):
+    """'Draft-2023-5' -> ('Draft-2023', 5)"""
+    pdf_id, page_nr = page_id.rsplit('-', 1)
+    return pdf_id, int(page_nr)
+
+def _parse_annotation_file(args):
+    path, mtime_ns = args
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return path, mtime_ns, data.get("canvasWidth"), data.get("canvasHeight"), parse_page_annotations(data)
+    except Exception as e:
+        return path, mtime_ns, None, None, e
+
+def connect(index_path, read_only=False):
+    if read_only:
+        conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(index_path)
+        conn.execute("PRAGMA foreign_keys = ON")
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            conn.executescript(f"""
+                DROP TABLE IF EXISTS annotations;
+                DROP TABLE IF EXISTS pages;
+                PRAGMA user_version = {SCHEMA_VERSION};
+            """)
+        conn.executescript(SCHEMA)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def build_annotation_index(annotations_dir=None, index_path=None, num_workers=None):
+    """
+    Parses all page annotation JSONs (in parallel) into a SQLite index.
+    Rebuilding is incremental: only files that are new or changed since the last
+    build are parsed again, pages whose JSON is gone are removed.
+
+    Args:
+        annotations_dir (Path): Folder with the `{page_id}.json` files.
+        index_path (Path): SQLite file (created if missing).
+        num_workers (int): Parser processes (default: all cores).
+    """
+    annotations_dir = Path(annotations_dir or ANNOTATIONS_DIR)
+    index_path = Path(index_path or INDEX_PATH)
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with os.scandir(annotations_dir) as entries:
+        files = {e.name[:-len(".json")]: (e.path, e.stat().st_mtime_ns)
+                 for e in entries if e.name.endswith(".json") and e.is_file()}
+
+    conn = connect(index_path)
+    indexed = dict(conn.execute("SELECT page_id, mtime_ns FROM pages").fetchall())
+    removed = [pid for pid in indexed if pid not in files]
+    jobs = [(path, mtime_ns) for pid, (path, mtime_ns) in files.items() if indexed.get(pid) != mtime_ns]
+    print(f"[Info] {len(files)} annotation files: {len(jobs)} to parse, "
+          f"{len(files) - len(jobs)} unchanged, {len(removed)} removed.")
+
+    errors = 0
+    with conn, Pool(num_workers or os.cpu_count()) as workers:
+        conn.executemany("DELETE FROM pages WHERE page_id = ?", [(pid,) for pid in removed])
+        parsed = workers.imap_unordered(_parse_annotation_file, jobs, chunksize=64)
+        for path, mtime_ns, canvas_w, canvas_h, records in tqdm(parsed, total=len(jobs), desc="Indexing"):
+            page_id = Path(path).stem
+            if isinstance(records, Exception):
+                print(f"[Error] Could not parse {path}: {records}")
+                errors += 1
+                continue
+            try:
+                pdf_id, page_nr = page_id_parts(page_id)
+            except ValueError:
+                print(f"[Warning] Unexpected page id {page_id}, skipping.")
+                continue
+            conn.execute("DELETE FROM pages WHERE page_id = ?", (page_id,))
+            conn.execute("INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                         (page_id, pdf_id, page_nr, canvas_w, canvas_h, mtime_ns))
+            conn.executemany("INSERT INTO annotations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             [_annotation_row(page_id, pos, r, canvas_w, canvas_h) for pos, r in enumerate(records)])
+
+    total = conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+    conn.close()
+    print(f"Done! {total} pages indexed in {index_path} ({errors} errors).")
+
+def _annotation_row(page_id, position, record, canvas_w, canvas_h):
+    x = y = w = h = None
+    rel = (None, None, None, None)
+    if record["rect"] is not None:
+        x, y, w, h = record["rect"]
+        if canvas_w and canvas_h:
+            # Page-size independent rect (0..1), the PDF page scales it back
+            rel = (x / canvas_w, y / canvas_h, (x + w) / canvas_w, (y + h) / canvas_h)
+    return (page_id, position, record["annotation_id"], record["kind"], int(record["is_figure"]),
+            int(record["is_caption"]), record["parent"], x, y, w, h, *rel)
+
+def load_page_annotations(conn, page_id):
+    """
+    Returns (canvas_width, canvas_height, records) in the format of
+    parse_page_annotations, or None if the page is not in the index.
+    """
+    page = conn.execute("SELECT canvas_width, canvas_height FROM pages WHERE page_id = ?", (page_id,)).fetchone()
+    if page is None:
+        return None
+    rows = conn.execute("SELECT annotation_id, kind, is_figure, is_caption, parent, x, y, w, h FROM annotations "
+                        "WHERE page_id = ? ORDER BY position", (page_id,)).fetchall()
+    records = [{
+        "annotation_id": row["annotation_id"],
+        "kind": row["kind"],
+        "is_figure": bool(row["is_figure"]),
+        "is_caption": bool(row["is_caption"]),
+        "parent": row["parent"],
+        "rect": None if row["x"] is None else (row["x"], row["y"], row["w"], row["h"]),
+    } for row in rows]
+    return page["canvas_width"], page["canvas_height"], records
+
+def find_pages(conn, min_figures=1, with_caption=False):
+    """
+    Page ids with at least `min_figures` figures, e.g. find_pages(conn, 2, with_caption=True)
+    for compound candidates whose figures have a caption.
+    """
+    query = """
+        SELECT f.page_id FROM annotations f
+        WHERE f.is_figure = 1
+        GROUP BY f.page_id
+        HAVING COUNT(*) >= ?
+    """
+    if with_caption:
+        query += """ AND SUM(EXISTS (
+            SELECT 1 FROM annotations c
+            WHERE c.page_id = f.page_id AND c.is_caption = 1 AND c.parent = f.annotation_id
+        )) > 0"""
+    return [row[0] for row in conn.execute(query + " ORDER BY f.page_id", (min_figures,))]
+
+def kind_counts(conn):
+    """{kind: (annotations, pages)} over the whole index."""
+    rows = conn.execute("SELECT kind, COUNT(*), COUNT(DISTINCT page_id) FROM annotations GROUP BY kind")
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the SCI-3000 annotation index (SQLite).")
+    parser.add_argument("--annotations", type=Path, default=ANNOTATIONS_DIR)
+    parser.add_argument("--index", type=Path, default=INDEX_PATH)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    build_annotation_index(args.annotations, args.index, args.workers)
+    with connect(args.index, read_only=True) as conn:
+        for kind, (annotations, pages) in sorted(kind_counts(conn).items(), key=lambda kv: str(kv[0])):
+            print(f"  {str(kind):<10} {annotations:>7} annotations on {pages:>6} pages")
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,114 @@
+import hashlib
 import json
 import fitz  # PyMuPDF
+import numpy as np
 import os
+from multiprocessing import Pool
 from tqdm import tqdm
+try:
+    from ShardedArchive import ShardReader, ShardWriter
+    from PageRasterCache import CACHE_MAX_GB, PageRasterCache
+    from SCI3000AnnotationIndex import connect, load_page_annotations, parse_page_annotations
+except ImportError:  # Imported as utils.SCI3000Extractor (notebooks)
+    from utils.ShardedArchive import ShardReader, ShardWriter
+    from utils.PageRasterCache import CACHE_MAX_GB, PageRasterCache
+    from utils.SCI3000AnnotationIndex import connect, load_page_annotations, parse_page_annotations
+
+# Figures are rendered at this resolution unless a pixel budget asks for less
+MAX_DPI = 300
+# image_format -> (Pillow format, file extension)
+IMAGE_FORMATS = {"png": ("PNG", "png"), "jpeg": ("JPEG", "jpg"), "webp": ("WEBP", "webp")}
+
+class PageWords:
+    """
+    Words of one page from a single get_text("words") call, bucketed into a
+    uniform grid by their center point. Caption rects are answered from the grid
+    instead of re-walking the page's text layer for every figure.
+    """
+    CELL_SIZE = 64  # PDF points
+
+    def __init__(self, page):
+        self.words = page.get_text("words")
+        self.grid = {}
+        for i, word in enumerate(self.words):
+            cx, cy = (word[0] + word[2]) / 2, (word[1] + word[3]) / 2
+            self.grid.setdefault((int(cx // self.CELL_SIZE), int(cy // self.CELL_SIZE)), []).append(i)
+
+    def query(self, rect):
+        """
+        Words whose center lies inside rect, in reading order (block, line, word).
+        Words are kept whole, also where the rect cuts through them.
+        """
+        hits = []
+        for gx in range(int(rect.x0 // self.CELL_SIZE), int(rect.x1 // self.CELL_SIZE) + 1):
+            for gy in range(int(rect.y0 // self.CELL_SIZE), int(rect.y1 // self.CELL_SIZE) + 1):
+                for i in self.grid.get((gx, gy), ()):
+                    word = self.words[i]
+                    cx, cy = (word[0] + word[2]) / 2, (word[1] + word[3]) / 2
+                    if rect.x0 <= cx <= rect.x1 and rect.y0 <= cy <= rect.y1:
+                        hits.append(word)
+        hits.sort(key=lambda word: word[5:8])
+        return hits
 
 def extract_figures_and_captions(
     page_ids: list, 
     pdf_input_dir: str, 
     annotations_folder: str, 
     output_dir: str, 
-    metadata_file: str = "extracted_figures_metadata.json"
+    metadata_file: str = "extracted_figures_metadata.json",
+    output_format: str = "files",
+    num_workers: int = None,
+    annotation_index: str = None,
+    image_format: str = "png",
+    compression_level: int = None,
+    max_dpi: int = MAX_DPI,
+    max_pixels: int = None,
+    max_side: int = None,
+    content_hash: bool = False,
+    page_cache_dir: str = None,
+    page_cache_gb: float = CACHE_MAX_GB
 ):
     """
     Extracts figures and their corresponding captions from SCI-3000 PDFs based on JSON annotations.
-    Includes a progress bar and skips pages that have already been processed.
+    Includes a progress bar and skips figures that have already been extracted.
+    PDFs are processed in parallel worker processes.
     
     Args:
         page_ids (list): List of page identifiers (e.g., 'Draft-123-5').
         pdf_input_dir (str): Path to the folder containing raw PDFs.
         annotations_folder (str): Path to the folder containing JSON annotation files.
         output_dir (str): Path where images and metadata will be saved.
-        metadata_file (str): Filename for the metadata registry.
+        metadata_file (str): Filename for the metadata registry. While running, figures
+            are appended to a journal next to it (same name, `.jsonl`).
+        output_format (str): "files" (one PNG per figure) or "shards" (tar shards with
+            an offset index in `output_dir/shards`, see ShardedArchive.py).
+        num_workers (int): Processes rasterizing PDFs in parallel, one PDF per job
+            (default: all cores, 1 = no worker processes).
+        annotation_index (str): Optional SQLite index built by SCI3000AnnotationIndex.py.
+            If given, annotations are read from it instead of the per-page JSON files.
+        image_format (str): "png", "jpeg" or "webp".
+        compression_level (int): PNG: zlib level 0-9. JPEG/WebP: quality 1-100.
+            None keeps the encoder defaults (PyMuPDF's PNG encoder, quality 90).
+        max_dpi (int): Render resolution for figures that fit the pixel budget.
+        max_pixels (int): Optional budget for width * height of a figure.
+        max_side (int): Optional budget for the longer side of a figure.
+            With a budget, the DPI is chosen per figure (integer, at most max_dpi)
+            and stored in the metadata together with the scale factor.
+        content_hash (bool): Store each distinct rendered figure once, under
+            `objects/<hash[:2]>/<hash>.<ext>` (keyed by its pixels). Duplicates only
+            reference the stored file and are not encoded again.
+        page_cache_dir (str): Optional cache of full page rasters (see PageRasterCache.py).
+            Figures are cropped from the cached page instead of being rendered again,
+            which makes re-extraction with changed crops fast. Pages are cached at max_dpi;
+            with a pixel budget, smaller crops are area-resampled from that raster.
+        page_cache_gb (float): Disk budget of the page cache (LRU eviction).
         
     Returns:
         list: A list of dictionaries containing metadata for all extracted figures.
     """
+    raster = raster_settings(image_format, compression_level, max_dpi, max_pixels, max_side,
+                             content_hash, page_cache_dir, page_cache_gb)
+
     #if not list or pandas series
     if not isinstance(page_ids, list) and not hasattr(page_ids, "tolist"):
         print("[Warning] No page IDs provided for extraction.")
@@ -33,19 +118,36 @@ def extract_figures_and_captions(
     metadata_output_path = os.path.join(output_dir, metadata_file)
     
     # --- RESUME LOGIC ---
-    extracted_metadata = []
-    processed_page_ids = set()
+    # The journal (one JSON line per figure, plus a marker per completed page) is the
+    # source of truth while running, the metadata JSON is compacted from it.
+    journal_path = os.path.splitext(metadata_output_path)[0] + ".jsonl"
+    journal_lines = read_metadata_journal(journal_path)
 
-    if os.path.exists(metadata_output_path):
+    if not journal_lines and os.path.exists(metadata_output_path):
+        # Metadata from a run before the journal existed: seed the journal with it
         print(f"[Info] Loading existing metadata from {metadata_output_path}...")
         try:
             with open(metadata_output_path, 'r', encoding='utf-8') as f:
-                extracted_metadata = json.load(f)
-            # Create a set of already processed page IDs for fast lookup
-            processed_page_ids = set(entry['page_id'] for entry in extracted_metadata)
-            print(f"[Info] Found {len(processed_page_ids)} already processed pages. Skipping them.")
+                legacy_metadata = json.load(f)
+            # Back then, a page with figures in the metadata counted as done
+            journal_lines = legacy_metadata + [{"page_done": pid} for pid in dict.fromkeys(
+                entry['page_id'] for entry in legacy_metadata)]
+            with open_metadata_journal(journal_path) as journal:
+                append_to_journal(journal, journal_lines)
         except Exception as e:
             print(f"[Warning] Could not load existing metadata: {e}. Starting fresh.")
+            journal_lines = []
+
+    # Pages with a marker are skipped. On all other pages, only figures that are
+    # not in the journal yet are rendered.
+    processed_page_ids = set(line['page_done'] for line in journal_lines if 'page_done' in line)
+    done_figures = {}
+    for line in journal_lines:
+        if 'page_done' not in line:
+            done_figures.setdefault(line['page_id'], set()).add(line['figure_id'])
+    if processed_page_ids or done_figures:
+        print(f"[Info] Found {len(processed_page_ids)} completed pages and "
+              f"{sum(len(f) for f in done_figures.values())} extracted figures. Skipping them.")
 
     # Filter out page_ids that are already done
     # Note: We keep the original list for structure, but we skip inside the loop or filter here.
@@ -54,7 +156,8 @@ def extract_figures_and_captions(
     
     if not pages_to_process:
         print("All pages have already been processed.")
-        return extracted_metadata
+        # A previous run may have stopped between journaling and compaction
+        return compact_metadata_journal(journal_path, metadata_output_path)
 
     # Group pages by PDF ID again (only for the remaining pages)
     pdf_map = {}
@@ -65,133 +168,379 @@ def extract_figures_and_captions(
             pdf_map[pdf_id] = []
         pdf_map[pdf_id].append(pid)
 
-    print(f"Starting extraction for {len(pages_to_process)} new pages from {len(pdf_map)} PDFs...")
-    
+    num_workers = max(1, min(num_workers or os.cpu_count(), len(pdf_map)))
+    print(f"Starting extraction for {len(pages_to_process)} new pages from {len(pdf_map)} PDFs ({num_workers} workers)...")
+    shard_writer = ShardWriter(os.path.join(output_dir, "shards"), prefix="figures") if output_format == "shards" else None
+
+    # One job per PDF: each worker opens its own document.
+    # In shard mode the PNG bytes travel back to the parent, which owns the shard writer.
+    jobs = [
+        (pdf_id, current_pdf_pages, {pid: done_figures[pid] for pid in current_pdf_pages if pid in done_figures},
+         pdf_input_dir, annotations_folder, annotation_index, output_dir, raster, shard_writer is not None)
+        for pdf_id, current_pdf_pages in pdf_map.items()
+    ]
+    # Content-addressed samples already in the shards (written once, referenced by hash)
+    stored_objects = set(ShardReader(shard_writer.out_dir, "figures").keys()) \
+        if shard_writer is not None and content_hash else set()
+
     # --- PROCESSING LOOP WITH PROGRESS BAR ---
-    # We iterate over PDFs to open files efficiently, but update the progress bar per page
+    # Results arrive per PDF (in completion order), the progress bar counts pages
+
+    # Workers get the stored hashes once, so they do not encode duplicates just to have them discarded
+    pool = Pool(num_workers, initializer=_init_extract_worker, initargs=(stored_objects,)) \
+        if num_workers > 1 else None
+    if pool is None:
+        _init_extract_worker(set(stored_objects))
+    try:
+        results = pool.imap_unordered(_extract_pdf, jobs) if pool else map(_extract_pdf, jobs)
+
+        with tqdm(total=len(pages_to_process), desc="Extracting Pages", unit="page") as pbar, \
+             open_metadata_journal(journal_path) as journal:
+
+            for pdf_id, num_pages, figures, pages_done in results:
+                entries = []
+                for meta_entry, image_bytes in figures:
+                    if shard_writer is not None:
+                        key = os.path.splitext(meta_entry["image_filename"])[0]
+                        if key not in stored_objects:
+                            shard_writer.write(key, {
+                                IMAGE_FORMATS[image_format][1]: image_bytes,
+                                "json": json.dumps(meta_entry, ensure_ascii=False)
+                            })
+                            if content_hash:
+                                stored_objects.add(key)
+                    entries.append(meta_entry)
+                # Page markers after the figures: a page only counts as done once all its figures are journaled
+                entries.extend({"page_done": pid} for pid in pages_done)
+                pbar.update(num_pages)
+
+                # Figures must be readable from the shards before the metadata lists them
+                if shard_writer is not None:
+                    shard_writer.flush()
+
+                # Checkpoint after each PDF: only this PDF's figures and pages are appended
+                append_to_journal(journal, entries)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if shard_writer is not None:
+            shard_writer.close()
+
+    extracted_metadata = compact_metadata_journal(journal_path, metadata_output_path)
+    print(f"Extraction complete. Metadata saved to {metadata_output_path}")
+    return extracted_metadata
+
+def raster_settings(image_format="png", compression_level=None, max_dpi=MAX_DPI, max_pixels=None,
+                    max_side=None, content_hash=False, page_cache_dir=None, page_cache_gb=CACHE_MAX_GB):
+    """Rendering/encoding options handed to the workers (see extract_figures_and_captions)."""
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format {image_format!r}, expected one of {list(IMAGE_FORMATS)}")
+    return {
+        "image_format": image_format,
+        "compression_level": compression_level,
+        "max_dpi": max_dpi,
+        "max_pixels": max_pixels,
+        "max_side": max_side,
+        "content_hash": content_hash,
+        "page_cache_dir": page_cache_dir,
+        "page_cache_bytes": int(page_cache_gb * 1024**3),
+    }
+
+def read_metadata_journal(journal_path):
+    """
+    Reads all lines (figure entries and {"page_done": page_id} markers) from the
+    JSONL journal. A truncated last line (crash while writing) is skipped.
+    """
+    entries = []
+    if not os.path.exists(journal_path):
+        return entries
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"[Warning] Skipping broken line in {journal_path}")
+    return entries
+
+def open_metadata_journal(journal_path):
+    needs_newline = False
+    if os.path.exists(journal_path) and os.path.getsize(journal_path) > 0:
+        with open(journal_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    journal = open(journal_path, "a", encoding='utf-8')
+    # Terminate a partially written last line so the next entry starts on its own line
+    if needs_newline:
+        journal.write("\n")
+    return journal
+
+def append_to_journal(journal, entries):
+    """Appends the entries (one line each) and makes them durable before returning."""
+    for entry in entries:
+        journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+
+def compact_metadata_journal(journal_path, metadata_output_path):
+    """
+    Writes the metadata JSON from the journal (last entry per figure wins).
+    The file is replaced atomically, so a crash never leaves a half-written copy.
+    """
+    entries = {}
+    for entry in read_metadata_journal(journal_path):
+        if "page_done" not in entry:
+            entries[(entry["page_id"], entry["figure_id"])] = entry
+    extracted_metadata = list(entries.values())
+    tmp_path = metadata_output_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(extracted_metadata, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, metadata_output_path)
+    return extracted_metadata
+
+_page_cache = None
+# Content hashes already in the shards (per process); figures with these are returned without bytes
+_stored_digests = set()
+
+def get_page_cache(cache_dir, max_bytes):
+    # One cache per process, it keeps track of the directory size
+    global _page_cache
+    if _page_cache is None or _page_cache.cache_dir != str(cache_dir):
+        _page_cache = PageRasterCache(cache_dir, max_bytes)
+    return _page_cache
+
+def _init_extract_worker(stored_digests):
+    global _stored_digests
+    _stored_digests = stored_digests
+
+def _extract_pdf(job):
+    """
+    Worker: extracts all requested pages of one PDF.
+
+    Returns:
+        tuple: (pdf_id, number of pages handled, [(meta_entry, image_bytes or None), ...],
+            ids of the pages whose figures are now all extracted). With keep_bytes,
+            image_bytes is None for content hashes the parent has already stored.
+    """
+    pdf_id, page_ids, done_figures, pdf_input_dir, annotations_folder, annotation_index, output_dir, raster, keep_bytes = job
+    pdf_path = os.path.join(pdf_input_dir, f"{pdf_id}.pdf")
+
+    # Check if PDF exists
+    if not os.path.exists(pdf_path):
+        # print(f"[Warning] PDF not found: {pdf_path}")
+        return pdf_id, len(page_ids), [], []
+
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        print(f"[Error] Could not open {pdf_path}: {e}")
+        return pdf_id, len(page_ids), [], []
+
+    conn = connect(annotation_index, read_only=True) if annotation_index else None
+    figures = []
+    pages_done = []
+    for page_id in page_ids:
+        try:
+            annotations = load_annotations(page_id, annotations_folder, conn)
+            if annotations is None:
+                continue
+            page_figures, failed = extract_page(doc, pdf_id, page_id, annotations, output_dir, raster,
+                                                keep_bytes, done_figures.get(page_id, ()),
+                                                stored_digests=_stored_digests)
+            figures.extend(page_figures)
+            # The parent stores these before it sees any later result of this worker
+            if keep_bytes:
+                _stored_digests.update(entry["content_hash"] for entry, image_bytes in page_figures
+                                       if image_bytes is not None and entry["content_hash"] is not None)
+            if not failed:
+                pages_done.append(page_id)
+        except Exception as e:
+            #Catch-all for page processing errors
+            print(f"[Error] Processing failed for {page_id}: {e}")
+
+    if conn is not None:
+        conn.close()
+    doc.close()
+    return pdf_id, len(page_ids), figures, pages_done
+
+def load_annotations(page_id, annotations_folder, conn=None):
+    """
+    (canvas_width, canvas_height, records) of one page from the index, or from its
+    JSON file if no index is used. None if the page has no annotations.
+    """
+    if conn is not None:
+        return load_page_annotations(conn, page_id)
+    json_path = os.path.join(annotations_folder, f"{page_id}.json")
+    if not os.path.exists(json_path):
+        return None
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+    return data.get("canvasWidth"), data.get("canvasHeight"), parse_page_annotations(data)
+
+def figure_dpi(rect, max_dpi=MAX_DPI, max_pixels=None, max_side=None):
+    """
+    Highest integer DPI (at most max_dpi) at which the rect (in PDF points)
+    stays within the pixel budgets.
+    """
+    dpi = max_dpi
+    if max_side and max(rect.width, rect.height) > 0:
+        dpi = min(dpi, max_side * 72 / max(rect.width, rect.height))
+    if max_pixels and rect.width * rect.height > 0:
+        dpi = min(dpi, 72 * (max_pixels / (rect.width * rect.height)) ** 0.5)
+    return max(1, int(dpi))
+
+def pixmap_digest(pix):
+    """Content hash of the rendered pixels (independent of the image encoding)."""
+    digest = hashlib.blake2b(f"{pix.width}x{pix.height}x{pix.n}".encode(), digest_size=16)
+    digest.update(pix.samples)
+    return digest.hexdigest()
+
+def encode_pixmap(pix, image_format="png", compression_level=None):
+    if image_format == "png" and compression_level is None:
+        return pix.tobytes("png")
+    pil_format = IMAGE_FORMATS[image_format][0]
+    if image_format == "png":
+        return pix.pil_tobytes(pil_format, compress_level=compression_level)
+    quality = compression_level if compression_level is not None else 90
+    return pix.pil_tobytes(pil_format, quality=quality)
+
+def pixmap_to_array(pix):
+    """Pixels of a pixmap as a BGR uint8 array (OpenCV channel order)."""
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.colorspace is None or pix.colorspace.n != 3:
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    rgb = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, 3)
+    return np.ascontiguousarray(rgb[:, :, ::-1])
+
+def extract_page(doc, pdf_id, page_id, annotations, output_dir, raster, keep_bytes=False, done_figures=(),
+                 as_array=False, stored_digests=()):
+    """
+    Extracts the figures and captions of one annotated page, except the figure ids
+    in done_figures. The images are saved to output_dir, or returned as bytes if
+    keep_bytes is set (None for content hashes in stored_digests, which are not
+    encoded), or as BGR arrays without encoding if as_array is set
+    (image_filename is None then).
+
+    Returns:
+        tuple: ([(meta_entry, image_bytes / array or None), ...], number of failed figures)
+    """
+    canvas_w, canvas_h, records = annotations
+
+    # Load page (1-based index in ID -> 0-based index in PyMuPDF)
+    page_nr = int(page_id.split('-')[-1])
+    page = doc.load_page(page_nr - 1)
+
+    # Coordinate scaling
+    pdf_w = page.rect.width
+    pdf_h = page.rect.height
+    json_w = canvas_w if canvas_w is not None else pdf_w
+    json_h = canvas_h if canvas_h is not None else pdf_h
+    scale_x = pdf_w / json_w if json_w else 1
+    scale_y = pdf_h / json_h if json_h else 1
     
-    with tqdm(total=len(pages_to_process), desc="Extracting Pages", unit="page") as pbar:
-        
-        for pdf_id, current_pdf_pages in pdf_map.items():
-            pdf_path = os.path.join(pdf_input_dir, f"{pdf_id}.pdf")
+    # --- PASS 1: Index Captions ---
+    caption_map = {} 
+    for record in records:
+        if record["is_caption"] and record["parent"] and record["rect"] is not None:
+            cx, cy, cw, ch = record["rect"]
+            caption_map[record["parent"]] = fitz.Rect(
+                cx * scale_x, cy * scale_y, (cx + cw) * scale_x, (cy + ch) * scale_y
+            )
+
+    page_cache = get_page_cache(raster["page_cache_dir"], raster["page_cache_bytes"]) \
+        if raster["page_cache_dir"] else None
+
+    # Text layer of the page, read once and only if a caption needs it
+    page_words = PageWords(page) if caption_map else None
+
+    # --- PASS 2: Extract Figures ---
+    figures = []
+    failed = 0
+    figure_counter = -1
+    
+    for record in records:
+        if record["is_figure"]:
+            fig_anno_id = record["annotation_id"]
+            if record["rect"] is None: continue
+            # Ids follow the annotation order, also past failed figures, so a retry keeps them stable
+            figure_counter += 1
+            if figure_counter in done_figures: continue
             
-            # Check if PDF exists
-            if not os.path.exists(pdf_path):
-                # If PDF is missing, we must update the pbar for all its pages to keep sync
-                # print(f"[Warning] PDF not found: {pdf_path}")
-                pbar.update(len(current_pdf_pages))
-                continue
+            x, y, w, h = record["rect"]
+            rect_points = fitz.Rect(x * scale_x, y * scale_y, (x + w) * scale_x, (y + h) * scale_y)
 
+            # Extract Image (High Res, within the pixel budget)
+            dpi = figure_dpi(rect_points, raster["max_dpi"], raster["max_pixels"], raster["max_side"])
+            zoom = dpi / 72
+            mat = fitz.Matrix(zoom, zoom)
+            extension = IMAGE_FORMATS[raster['image_format']][1]
+            out_filename = f"{page_id}-fig-{figure_counter}.{extension}"
+            digest = None
+            image_bytes = None
             try:
-                doc = fitz.open(pdf_path)
+                if page_cache is not None:
+                    # One cached raster per page: crops below max_dpi (pixel budget) are resampled from it
+                    pix = page_cache.crop(page, pdf_id, dpi, rect_points, cache_dpi=raster["max_dpi"])
+                else:
+                    pix = page.get_pixmap(matrix=mat, clip=rect_points)
+                if raster["content_hash"]:
+                    digest = pixmap_digest(pix)
+                if as_array:
+                    # Streaming: pixels go straight to the consumer, nothing is encoded or written
+                    image_bytes = pixmap_to_array(pix)
+                    out_filename = None
+                else:
+                    if digest is not None:
+                        out_filename = f"{digest}.{extension}" if keep_bytes else f"objects/{digest[:2]}/{digest}.{extension}"
+                    out_path = os.path.join(output_dir, out_filename)
+                    if digest is None or (digest not in stored_digests if keep_bytes else not os.path.exists(out_path)):
+                        image_bytes = encode_pixmap(pix, raster["image_format"], raster["compression_level"])
+                    if not keep_bytes:
+                        if image_bytes is not None:
+                            _write_atomic(out_path, image_bytes)
+                        image_bytes = None
             except Exception as e:
-                print(f"[Error] Could not open {pdf_path}: {e}")
-                pbar.update(len(current_pdf_pages))
+                print(f"[Error] Save failed for {out_filename}: {e}")
+                failed += 1
                 continue
-
-            for page_id in current_pdf_pages:
-                
-                # --- PROCESS PAGE ---
-                json_path = os.path.join(annotations_folder, f"{page_id}.json")
-                if not os.path.exists(json_path):
-                    pbar.update(1)
-                    continue
-                    
-                try:
-                    with open(json_path, 'r') as f:
-                        data = json.load(f)
-                
-                    # Load page (1-based index in ID -> 0-based index in PyMuPDF)
-                    page_nr = int(page_id.split('-')[-1])
-                    page = doc.load_page(page_nr - 1)
-
-                    # Coordinate scaling
-                    pdf_w = page.rect.width
-                    pdf_h = page.rect.height
-                    json_w = data.get("canvasWidth", pdf_w) 
-                    json_h = data.get("canvasHeight", pdf_h)
-                    scale_x = pdf_w / json_w if json_w else 1
-                    scale_y = pdf_h / json_h if json_h else 1
-                    
-                    # --- PASS 1: Index Captions ---
-                    caption_map = {} 
-                    for anno in data.get("annotations", []):
-                        body_list = anno.get("body", [])
-                        if not isinstance(body_list, list): continue
-
-                        parent_id = None
-                        is_caption = False
-                        for item in body_list:
-                            if item.get("value") == "Caption": is_caption = True
-                            if item.get("purpose") == "parent": parent_id = item.get("value")
-                        
-                        if is_caption and parent_id:
-                            selector = anno.get("target", {}).get("selector", {}).get("value", "")
-                            if "pixel:" in selector:
-                                coords_str = selector.split("pixel:")[1]
-                                cx, cy, cw, ch = map(float, coords_str.split(","))
-                                caption_map[parent_id] = fitz.Rect(
-                                    cx * scale_x, cy * scale_y, (cx + cw) * scale_x, (cy + ch) * scale_y
-                                )
-
-                    # --- PASS 2: Extract Figures ---
-                    figure_counter = 0 
-                    
-                    for anno in data.get("annotations", []):
-                        body_list = anno.get("body", [])
-                        if not isinstance(body_list, list): continue
-                        
-                        if any(item.get("value") == "Figure" for item in body_list):
-                            fig_anno_id = anno.get("id")
-                            selector = anno.get("target", {}).get("selector", {}).get("value", "")
-                            if "pixel:" not in selector: continue
-                            
-                            coords_str = selector.split("pixel:")[1]
-                            x, y, w, h = map(float, coords_str.split(","))
-                            rect_points = fitz.Rect(x * scale_x, y * scale_y, (x + w) * scale_x, (y + h) * scale_y)
-
-                            # Extract Image (High Res)
-                            zoom = 300 / 72
-                            mat = fitz.Matrix(zoom, zoom)
-                            try:
-                                pix = page.get_pixmap(matrix=mat, clip=rect_points)
-                                out_filename = f"{page_id}-fig-{figure_counter}.png"
-                                pix.save(os.path.join(output_dir, out_filename))
-                            except Exception as e:
-                                print(f"[Error] Save failed for {out_filename}: {e}")
-                                continue
-                            
-                            # Extract Caption
-                            caption_text = ""
-                            if fig_anno_id in caption_map:
-                                caption_text = page.get_text("text", clip=caption_map[fig_anno_id]).strip()
-                                caption_text = caption_text.replace('\n', ' ').replace('\r', '')
-
-                            meta_entry = {
-                                "pdf_id": pdf_id,
-                                "page_id": page_id,
-                                "figure_id": figure_counter,
-                                "original_annotation_id": fig_anno_id,
-                                "image_filename": out_filename,
-                                "caption": caption_text,
-                                "bbox_pdf_coords": [rect_points.x0, rect_points.y0, rect_points.x1, rect_points.y1]
-                            }
-                            extracted_metadata.append(meta_entry)
-                            figure_counter += 1
-                
-                except Exception as e:
-                    #Catch-all for page processing errors
-                    print(f"[Error] Processing failed for {page_id}: {e}")
-                
-                # Update progress bar
-                pbar.update(1)
             
-            doc.close()
-            
-            # OPTIONAL: Save metadata incrementally after each PDF (safer for large jobs)
-            # Only do this if speed is not critical, otherwise save at the end
-            with open(metadata_output_path, 'w', encoding='utf-8') as f:
-                json.dump(extracted_metadata, f, indent=4, ensure_ascii=False)
+            # Extract Caption
+            caption_text = ""
+            caption_bbox = None
+            caption_words = []
+            if fig_anno_id in caption_map:
+                caption_rect = caption_map[fig_anno_id]
+                caption_bbox = [caption_rect.x0, caption_rect.y0, caption_rect.x1, caption_rect.y1]
+                caption_words = page_words.query(caption_rect)
+                caption_text = " ".join(word[4] for word in caption_words).replace('\r', '')
 
-    print(f"Extraction complete. Metadata saved to {metadata_output_path}")
-    return extracted_metadata
\ No newline at end of file
+            meta_entry = {
+                "pdf_id": pdf_id,
+                "page_id": page_id,
+                "figure_id": figure_counter,
+                "original_annotation_id": fig_anno_id,
+                "image_filename": out_filename,
+                "caption": caption_text,
+                "bbox_pdf_coords": [rect_points.x0, rect_points.y0, rect_points.x1, rect_points.y1],
+                "dpi": dpi,
+                "scale": zoom,
+                "image_size": [pix.width, pix.height],
+                "content_hash": digest,
+                "caption_bbox_pdf_coords": caption_bbox,
+                # [x0, y0, x1, y1, word] in reading order
+                "caption_words": [[*word[:4], word[4]] for word in caption_words]
+            }
+            figures.append((meta_entry, image_bytes))
+
+    return figures, failed
+
+def _write_atomic(path, data):
+    # Workers may store the same object concurrently: never expose a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,171 @@
+import io
+import json
+import os
+import re
+import tarfile
+from pathlib import Path
+
+# Samples (image + label + metadata) per tar shard
+SHARD_SIZE = 1000
+
+IMAGE_EXTENSIONS = ("jpg", "jpeg", "png", "webp")
+
+def _index_path(tar_path):
+    return Path(tar_path).with_suffix(".json")
+
+class ShardWriter:
+    """
+    Writes samples into fixed-size tar shards (`{prefix}-000000.tar`, ...).
+
+    A sample is a key plus its members by extension, e.g.
+    {"jpg": b"...", "txt": b"...", "json": b"..."}. Next to every shard an index
+    (`{prefix}-000000.json`) stores byte offset and size of each member, so
+    readers can stream a shard sequentially or seek to a single sample.
+    Only samples listed in an index count as written; flush() updates it.
+    Existing shards are never modified, a new writer starts a new shard.
+    """
+    def __init__(self, out_dir, prefix="shard", shard_size=SHARD_SIZE):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.shard_size = shard_size
+        existing = [int(m.group(1)) for p in self.out_dir.glob(f"{prefix}-*.json")
+                    if (m := re.fullmatch(rf"{re.escape(prefix)}-(\d{{6}})\.json", p.name))]
+        self._next_shard_no = max(existing, default=-1) + 1
+        self._tar = None
+        self._tar_path = None
+        self._samples = []
+
+    def _open_next_shard(self):
+        self.close()
+        self._tar_path = self.out_dir / f"{self.prefix}-{self._next_shard_no:06d}.tar"
+        self._next_shard_no += 1
+        self._tar = tarfile.open(self._tar_path, "w", format=tarfile.GNU_FORMAT)
+        self._samples = []
+
+    def write(self, key, members):
+        if self._tar is None or len(self._samples) >= self.shard_size:
+            self._open_next_shard()
+        entry = {"key": key, "members": {}}
+        for ext, data in members.items():
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            info = tarfile.TarInfo(f"{key}.{ext}")
+            info.size = len(data)
+            self._tar.addfile(info, io.BytesIO(data))
+            # Data ends on a 512-byte block boundary right before the current offset
+            padded = -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            entry["members"][ext] = [self._tar.offset - padded, info.size]
+        self._samples.append(entry)
+
+    def flush(self):
+        """Makes all samples written so far visible to readers."""
+        if self._tar is None:
+            return
+        self._tar.fileobj.flush()
+        os.fsync(self._tar.fileobj.fileno())
+        self._write_index()
+
+    def close(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        self._write_index()
+        self._tar = None
+
+    def _write_index(self):
+        index_path = _index_path(self._tar_path)
+        tmp_path = index_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"shard": self._tar_path.name, "samples": self._samples}, f)
+        os.replace(tmp_path, index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ShardReader:
+    """
+    Reads samples written by ShardWriter, using the shard indexes only
+    (no per-file stat calls). If a key occurs in several shards, the latest wins.
+    """
+    def __init__(self, shard_dir, prefix="shard"):
+        self.shard_dir = Path(shard_dir)
+        self.shards = []     # (tar path, samples) in shard order
+        self._lookup = {}    # key -> (tar path, members)
+        for index_path in sorted(self.shard_dir.glob(f"{prefix}-*.json")):
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            tar_path = self.shard_dir / index["shard"]
+            self.shards.append((tar_path, index["samples"]))
+            for sample in index["samples"]:
+                self._lookup[sample["key"]] = (tar_path, sample["members"])
+
+    def __len__(self):
+        return len(self._lookup)
+
+    def __contains__(self, key):
+        return key in self._lookup
+
+    def keys(self):
+        return list(self._lookup.keys())
+
+    def members(self, key):
+        return list(self._lookup[key][1].keys())
+
+    def location(self, key, ext):
+        """(tar path, byte offset, size) of a member."""
+        tar_path, members = self._lookup[key]
+        offset, size = members[ext]
+        return tar_path, offset, size
+
+    def read(self, key, ext):
+        """Random access to a single member."""
+        tar_path, members = self._lookup[key]
+        offset, size = members[ext]
+        with open(tar_path, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def __iter__(self):
+        """
+        Yields (key, {ext: bytes}) shard by shard in file order (sequential I/O).
+        """
+        for tar_path, samples in self.shards:
+            with open(tar_path, "rb") as f:
+                for sample in samples:
+                    if self._lookup[sample["key"]][0] != tar_path:
+                        continue  # Superseded by a later shard
+                    data = {}
+                    for ext, (offset, size) in sample["members"].items():
+                        f.seek(offset)
+                        data[ext] = f.read(size)
+                    yield sample["key"], data
+
+def has_shards(directory, prefix="shard"):
+    directory = Path(directory)
+    return directory.is_dir() and any(directory.glob(f"{prefix}-*.json"))
+
+def unpack_shards(shard_dir, img_dir, lbl_dir=None, prefix="shard"):
+    """
+    Writes the samples back as one image (+ one .txt label) per key, for tools
+    that still expect the plain directory layout. Reads the shards sequentially.
+    """
+    img_dir = Path(img_dir)
+    img_dir.mkdir(parents=True, exist_ok=True)
+    if lbl_dir is not None:
+        lbl_dir = Path(lbl_dir)
+        lbl_dir.mkdir(parents=True, exist_ok=True)
+
+    count = 0
+    for key, data in ShardReader(shard_dir, prefix):
+        for ext in IMAGE_EXTENSIONS:
+            if ext in data:
+                (img_dir / f"{key}.{ext}").write_bytes(data[ext])
+                break
+        if lbl_dir is not None and "txt" in data:
+            (lbl_dir / f"{key}.txt").write_bytes(data["txt"])
+        count += 1
+    return count
@@ -0,0 +1,240 @@
+import argparse
+import os
+import queue
+import time
+import fitz  # PyMuPDF
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tqdm import tqdm
+
+try:
+    from SCI3000Extractor import MAX_DPI, extract_page, load_annotations, raster_settings, \
+        read_metadata_journal, open_metadata_journal, append_to_journal
+    from SCI3000AnnotationIndex import connect, page_id_parts
+    from CompoundInference import make_detector, prepare, write_crops, \
+        WEIGHTS, IMGSZ, BATCH_SIZE, CONF, IOU, WRITE_THREADS
+except ImportError:  # Imported as utils.StreamingSeparator (notebooks)
+    from utils.SCI3000Extractor import MAX_DPI, extract_page, load_annotations, raster_settings, \
+        read_metadata_journal, open_metadata_journal, append_to_journal
+    from utils.SCI3000AnnotationIndex import connect, page_id_parts
+    from utils.CompoundInference import make_detector, prepare, write_crops, \
+        WEIGHTS, IMGSZ, BATCH_SIZE, CONF, IOU, WRITE_THREADS
+
+# --- KONFIGURATION ---
+OUTPUT_DIR = Path("../../dataset/05_inference/streaming")
+RECORDS_FILE = "separated_figures.jsonl"
+# Rendered figures waiting for detection; renderers block when it is full (backpressure)
+QUEUE_SIZE = 16
+# Longer figure side is capped at render time (None = full MAX_DPI); crops come from this raster
+MAX_SIDE = 2400
+# Interval (s) at which the detection process checks that renderers are still alive
+POLL_SECONDS = 5
+
+def _render_worker(task_queue, figure_queue, pdf_input_dir, annotations_folder, annotation_index,
+                   raster, done_figures):
+    """
+    Renderer process: takes PDF jobs from task_queue until it gets None and puts
+    (meta_entry, image) per figure on figure_queue, then None
+    (also if it fails, the exit code tells the detection process).
+    """
+    conn = None
+    try:
+        conn = connect(annotation_index, read_only=True) if annotation_index else None
+        while True:
+            job = task_queue.get()
+            if job is None:
+                break
+            pdf_id, page_ids = job
+            pdf_path = os.path.join(pdf_input_dir, f"{pdf_id}.pdf")
+            if not os.path.exists(pdf_path):
+                continue
+            try:
+                doc = fitz.open(pdf_path)
+            except Exception as e:
+                print(f"[Error] Could not open {pdf_path}: {e}")
+                continue
+            for page_id in page_ids:
+                try:
+                    annotations = load_annotations(page_id, annotations_folder, conn)
+                    if annotations is None:
+                        continue
+                    figures, _ = extract_page(doc, pdf_id, page_id, annotations, None, raster,
+                                              done_figures=done_figures.get(page_id, ()), as_array=True)
+                except Exception as e:
+                    print(f"[Error] Processing failed for {page_id}: {e}")
+                    continue
+                for meta_entry, image in figures:
+                    # Only the raster is pickled; its letterboxed tensor is rebuilt by the detection process
+                    figure_queue.put((meta_entry, image))
+            doc.close()
+    finally:
+        if conn is not None:
+            conn.close()
+        figure_queue.put(None)
+
+def _next_figure(figure_queue, renderers, finished):
+    """
+    Next item of figure_queue. Raises RuntimeError if a renderer crashed, or died
+    (killed, e.g. out of memory) without sending its None, instead of waiting forever.
+    """
+    while True:
+        try:
+            return figure_queue.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            pass
+        crashed = [r for r in renderers if r.exitcode not in (None, 0)]
+        dead = [r for r in renderers if not r.is_alive()]
+        if crashed or len(dead) > finished:
+            codes = ", ".join(f"{r.name}: {r.exitcode}" for r in crashed or dead)
+            raise RuntimeError(f"Renderer process failed ({codes}), figures are missing.")
+
+def _figure_key(meta_entry):
+    return f"{meta_entry['page_id']}-fig-{meta_entry['figure_id']}"
+
+def _write_figure(output_dir, meta_entry, image, detections, save_crops):
+    key = _figure_key(meta_entry)
+    if save_crops:
+        write_crops(output_dir, key, image, detections)
+    return {**meta_entry, "figure_key": key, "detections": detections}
+
+def separate_pdfs(page_ids, pdf_input_dir, annotations_folder, output_dir=None, weights=None, num_workers=None,
+                  annotation_index=None, imgsz=IMGSZ, batch_size=BATCH_SIZE, conf=CONF, iou=IOU,
+                  max_dpi=MAX_DPI, max_side=MAX_SIDE, queue_size=QUEUE_SIZE, threads=None,
+                  save_crops=True, backend=None, inter_threads=None):
+    """
+    PDF pages -> figures -> sub-figures in one pass, without intermediate figure files.
+
+    Renderer processes rasterize the annotated figures (as in extract_figures_and_captions)
+    and put them as arrays on a bounded queue; this process batches them through the
+    detector and writes the sub-figure crops plus one JSONL record per figure (figure
+    metadata, caption, detections). Figures already in the JSONL are skipped, so an
+    interrupted run can be resumed.
+
+    Args:
+        page_ids (list): Page identifiers (e.g., 'Draft-123-5').
+        num_workers (int): Renderer processes (default: all cores but one).
+        queue_size (int): Max. rendered figures waiting for detection.
+        threads (int): Intra-op threads of the detection backend (inter_threads: inter-op, ONNX).
+        backend: Ready backend (callable on a float32 NCHW batch), overrides weights.
+
+    Returns:
+        dict: Figure count, figures/s and time spent waiting for renderers.
+    """
+    output_dir = Path(output_dir or OUTPUT_DIR)
+    (output_dir / "crops").mkdir(parents=True, exist_ok=True)
+    records_path = output_dir / RECORDS_FILE
+
+    done_figures = {}
+    for record in read_metadata_journal(records_path):
+        done_figures.setdefault(record["page_id"], set()).add(record["figure_id"])
+    if done_figures:
+        print(f"[Info] {sum(len(f) for f in done_figures.values())} figures already separated, skipping them.")
+
+    pdf_map = {}
+    for page_id in page_ids:
+        pdf_map.setdefault(page_id_parts(page_id)[0], []).append(page_id)
+    num_workers = max(1, min(num_workers or (os.cpu_count() or 2) - 1, len(pdf_map)))
+    raster = raster_settings(max_dpi=max_dpi, max_side=max_side)
+
+    task_queue = mp.Queue()
+    figure_queue = mp.Queue(maxsize=queue_size)
+    for job in pdf_map.items():
+        task_queue.put(job)
+    renderers = [mp.Process(target=_render_worker, daemon=True,
+                            args=(task_queue, figure_queue, pdf_input_dir, annotations_folder, annotation_index,
+                                  raster, {pid: done_figures[pid] for pid in page_ids if pid in done_figures}))
+                 for _ in range(num_workers)]
+    # Renderers are forked before the detector exists, so they do not inherit its thread pools
+    for renderer in renderers:
+        task_queue.put(None)
+        renderer.start()
+    print(f"Separating figures of {len(page_ids)} pages from {len(pdf_map)} PDFs ({num_workers} renderers)...")
+
+    count, waiting = 0, 0.0
+    start = time.perf_counter()
+    try:
+        detector = make_detector(weights, backend, imgsz, batch_size, conf, iou, threads, inter_threads)
+        batch_size = detector.batch_size
+        with ThreadPoolExecutor(WRITE_THREADS) as writers, open_metadata_journal(records_path) as records, \
+                tqdm(desc="Separating", unit="fig") as pbar:
+            writes, batch = [], []
+
+            def drain(limit):
+                # Records are journaled in order, each after its crops are on disk
+                done = []
+                while len(writes) > limit:
+                    done.append(writes.pop(0).result())
+                append_to_journal(records, done)
+
+            def flush():
+                prepared_batch = [prepare(image, detector.imgsz) for _, image in batch]
+                pred = detector.infer(prepared_batch)
+                for p, prepared, (meta_entry, image) in zip(pred, prepared_batch, batch):
+                    detections = detector.decode(p, prepared, image.shape)
+                    writes.append(writers.submit(_write_figure, output_dir, meta_entry, image, detections, save_crops))
+                pbar.update(len(batch))
+                batch.clear()
+                drain(2 * batch_size)
+
+            finished = 0
+            while finished < len(renderers):
+                t = time.perf_counter()
+                item = _next_figure(figure_queue, renderers, finished)
+                waiting += time.perf_counter() - t
+                if item is None:
+                    finished += 1
+                    continue
+                batch.append(item)
+                count += 1
+                if len(batch) == batch_size:
+                    flush()
+            if batch:
+                flush()
+            drain(0)
+    except BaseException:
+        # Separated figures are journaled, a rerun resumes after them
+        for renderer in renderers:
+            renderer.terminate()
+        raise
+
+    for renderer in renderers:
+        renderer.join()
+    crashed = [f"{r.name}: {r.exitcode}" for r in renderers if r.exitcode]
+    if crashed:
+        raise RuntimeError(f"Renderer process failed ({', '.join(crashed)}), figures are missing. "
+                           f"Run again to separate them.")
+    total = time.perf_counter() - start
+    stats = {"figures": count, "seconds": round(total, 2), "figures_per_s": round(count / total, 2) if total else 0.0,
+             "waiting_for_renderers_s": round(waiting, 2)}
+    print(f"Done! {count} figures in {total:.1f}s ({stats['figures_per_s']} fig/s), "
+          f"{waiting:.1f}s waiting for renderers. Records in {records_path}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream SCI-3000 PDF figures straight into sub-figure separation.")
+    parser.add_argument("pages", type=Path, help="Text file with one page id per line.")
+    parser.add_argument("--pdfs", type=Path, required=True)
+    parser.add_argument("--annotations", type=Path, default=None)
+    parser.add_argument("--annotation-index", type=Path, default=None)
+    parser.add_argument("--output", type=Path, default=OUTPUT_DIR)
+    parser.add_argument("--weights", type=Path, default=WEIGHTS, help=".pt weights or an exported .onnx model.")
+    parser.add_argument("--workers", type=int, default=None, help="Renderer processes.")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads of the detector.")
+    parser.add_argument("--inter-threads", type=int, default=None, help="Inter-op threads (ONNX Runtime).")
+    parser.add_argument("--imgsz", type=int, default=IMGSZ)
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    parser.add_argument("--queue", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--no-crops", action="store_true")
+    args = parser.parse_args()
+    if args.annotations is None and args.annotation_index is None:
+        parser.error("--annotations or --annotation-index is required")
+
+    with open(args.pages, 'r') as f:
+        page_ids = [line.strip() for line in f if line.strip()]
+    separate_pdfs(page_ids, args.pdfs, args.annotations, args.output, args.weights, args.workers,
+                  args.annotation_index, args.imgsz, args.batch, queue_size=args.queue, threads=args.threads,
+                  save_crops=not args.no_crops, inter_threads=args.inter_threads)
+
+if __name__ == "__main__":
+    main()
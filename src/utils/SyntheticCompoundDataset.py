@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import SyntheticCompoundGenerator
+from SyntheticCompoundGenerator import (
+    ASSET_CACHE_MB, LABEL_STUDIO_MAPPING, SEED, AssetCache, image_rng, load_asset_sampler, render_compound
+)
+
+# Consecutive layout draws tried before an item gives up (grids that need more unique assets than the pool has)
+MAX_RENDER_ATTEMPTS = 100
+
+class SyntheticCompoundDataset:
+    """
+    Map-style dataset that renders synthetic compound figures on the fly,
+    so synthetic data can be streamed into training without writing files.
+
+    Item `idx` of epoch 0 is identical to `synth_{idx:06d}` written by
+    SyntheticCompoundGenerator; other epochs draw new layouts from the same seed.
+    Works with torch.utils.data.DataLoader (any number of workers): every item
+    only depends on (seed, epoch, idx), and each worker process keeps its own
+    asset cache with its share of ASSET_CACHE_MB.
+
+    Returns (image, boxes): image is a BGR uint8 array (H, 1600, 3), boxes is a
+    float32 array (N, 5) of YOLO rows [class_id, cx, cy, w, h] (normalized).
+    """
+    def __init__(self, length, asset_pool=None, seed=SEED, epoch=0):
+        if asset_pool is None:
+            asset_pool = load_asset_sampler({item['name']: item['id'] for item in LABEL_STUDIO_MAPPING})
+        if not asset_pool:
+            raise ValueError("No assets available for synthetic compounds.")
+        self.length = length
+        self.asset_pool = asset_pool
+        self.seed = seed
+        self.epoch = epoch
+        self._cache_pid = os.getpid()
+
+    def set_epoch(self, epoch):
+        """
+        Call before each epoch. DataLoader workers only see the new epoch if
+        they are (re)started afterwards, i.e. with persistent_workers=False.
+        """
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.length
+
+    def _size_worker_cache(self):
+        """
+        First item in a new process: inside a DataLoader worker the asset cache
+        gets budget / num_workers, so all workers together stay at ASSET_CACHE_MB.
+        """
+        self._cache_pid = os.getpid()
+        try:
+            from torch.utils.data import get_worker_info
+        except ImportError:
+            return
+        info = get_worker_info()
+        if info is not None:
+            SyntheticCompoundGenerator._asset_cache = AssetCache(ASSET_CACHE_MB * 1024 * 1024 // info.num_workers)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.length
+        if not 0 <= idx < self.length:
+            raise IndexError(idx)
+        if self._cache_pid != os.getpid():
+            self._size_worker_cache()
+
+        seed = self.seed if self.epoch == 0 else f"{self.seed}-{self.epoch}"
+        attempts = min(self.length, MAX_RENDER_ATTEMPTS)
+        for attempt in range(attempts):
+            # Grid needs more unique assets than the pool has: skip to the next layout draw
+            draw = (idx + attempt) % self.length
+            result = render_compound(draw, self.asset_pool, image_rng(draw, seed=seed))
+            if result is not None:
+                return result["canvas"], np.asarray(result["boxes"], dtype=np.float32).reshape(-1, 5)
+        raise RuntimeError(f"No layout could be rendered for item {idx} after {attempts} attempts "
+                           f"(asset pool too small: {len(self.asset_pool)} assets).")
+
+    def __iter__(self):
+        for idx in range(self.length):
+            yield self[idx]
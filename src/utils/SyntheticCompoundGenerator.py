@@ -3,9 +3,23 @@ import cv2
 import numpy as np
 import random
 import os
+import re
+import queue
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import Pool
 from pathlib import Path
 from tqdm import tqdm
 from datetime import datetime
+from PIL import Image
+from AssetPack import AssetPack
+from ShardedArchive import ShardReader, ShardWriter
+
+try:
+    import resource  # Peak RSS reporting (Unix only)
+except ImportError:
+    resource = None
 
 # --- KONFIGURATION ---
 NUM_IMAGES_TO_GENERATE = 10000
@@ -13,19 +27,65 @@ NUM_IMAGES_TO_GENERATE = 10000
 # Paths (make sure these match your folder structure)
 ASSET_DIR = Path("../../dataset/02_assets/SCI-3000-Singles")
 JSON_INPUT_PATH = Path("../../dataset/02_assets/SCI-3000-Singles/single_labels.json")
+# Pre-decoded assets (built with AssetPack.py). Used instead of the PNGs if it exists.
+ASSET_PACK_PATH = Path("../../dataset/02_assets/SCI-3000-Singles.pack")
+# Assets whose panels leaked into val/test (written by PerceptualHashIndex.py), left out of the pool
+ASSET_EXCLUSIONS_PATH = Path("../../dataset/04_model_ready/leakage_exclusions.json")
 
 OUT_ROOT = Path("../../dataset/03_intermediate/SCI-3000_synthetic-generated")
 OUT_IMG_DIR = OUT_ROOT / "images"
 OUT_LBL_DIR = OUT_ROOT / "yolo-labels"
 OUT_JSON_FILE = OUT_ROOT / "synthetic_labels.json"
+# Append-only task log, one Label Studio task per line (written as images finish)
+OUT_JSONL_FILE = OUT_ROOT / "synthetic_labels.jsonl"
 OUT_CLASSES_FILE = Path("../../dataset/classes.json")
 
+# "files": one JPEG + one .txt per image (OUT_IMG_DIR / OUT_LBL_DIR)
+# "shards": tar shards of SHARD_SIZE images with an offset index each (OUT_SHARD_DIR),
+#           see ShardedArchive.py (unpack_shards restores the "files" layout)
+OUTPUT_FORMAT = "files"
+OUT_SHARD_DIR = OUT_ROOT / "shards"
+
 # TARGET WIDTH (typical figure width in high-res)
 PAGE_WIDTH = 1600 
 
+# Parallel generation. Every image index gets its own RNG derived from SEED,
+# so the output is identical for any NUM_WORKERS / CHUNK_SIZE.
+SEED = 42
+NUM_WORKERS = os.cpu_count() or 1  # 1 = generate in the main process
+CHUNK_SIZE = 16                    # Image indices handed to a worker at once
+
+# Resume: only generate indices whose image, YOLO label and JSONL task are missing.
+# COMPACT_JSON rewrites the JSONL into the Label Studio JSON (OUT_JSON_FILE) at the end.
+RESUME = True
+COMPACT_JSON = True
+
+# Writer pipeline: compositors hand finished canvases to a bounded queue and
+# writer threads (per process) do the JPEG encode and file I/O.
+WRITER_THREADS = 2
+WRITER_QUEUE_SIZE = 8
+
+# Render into reusable canvas buffers (per process) instead of allocating a new
+# canvas per figure; assets are resized directly into their canvas slot.
+REUSE_CANVAS_BUFFERS = True
+
+# Per-stage timings, only collected when set to a dict (stage -> list of seconds),
+# e.g. by GeneratorBenchmark.py
+STAGE_TIMES = None
+
+# Memory budget (total over all worker processes) for decoded full-size assets,
+# keyed on path; each worker gets ASSET_CACHE_MB / num_workers
+ASSET_CACHE_MB = 1024
+
+# Sampling weight per asset of a class (each asset is stored once)
 OVERSAMPLE_RULES = {
     "Table": 20, "Image": 10, "Chart": 1, "Subplot": 1, "Illustration": 2
 }
+# Optional target share of the drawn panels per class, e.g. {"Chart": 0.4, "Table": 0.2, ...}.
+# If set, it replaces OVERSAMPLE_RULES; classes not listed are never drawn.
+CLASS_TARGET_DISTRIBUTION = None
+# Never place the same asset twice in one figure
+UNIQUE_ASSETS_PER_FIGURE = True
 
 LABEL_STUDIO_MAPPING = [
     {"id": 0, "name": "Chart"},
@@ -63,60 +123,316 @@ def setup_directories():
         json.dump(mapping_dict, f, indent=2)
     return {item['name']: item['id'] for item in LABEL_STUDIO_MAPPING}
 
-def load_and_oversample_assets(name_to_id):
+class AliasSampler:
+    """
+    Weighted sampler over a list of items (Walker/Vose alias table).
+    Every item is stored once; a draw costs O(1) regardless of the weights.
+    """
+    def __init__(self, items, weights):
+        n = len(items)
+        total = float(sum(weights))
+        scaled = [w * n / total for w in weights]
+        self.items = items
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Leftovers are 1.0 up to rounding errors
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def __len__(self):
+        return len(self.items)
+
+    def draw_index(self, rng):
+        i = rng.randrange(len(self.items))
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+    def sample(self, k, rng, unique=True):
+        """
+        Draws k items. With `unique`, no item is drawn twice (rejection sampling;
+        falls back to a uniform pick from the remaining items if the weights are
+        too skewed to find k distinct items quickly).
+        """
+        if not unique:
+            return [self.items[self.draw_index(rng)] for _ in range(k)]
+        if k > len(self.items):
+            raise ValueError(f"Cannot draw {k} unique items from {len(self.items)}")
+
+        chosen = []
+        seen = set()
+        attempts = 0
+        while len(chosen) < k and attempts < 50 * k:
+            i = self.draw_index(rng)
+            attempts += 1
+            if i not in seen:
+                seen.add(i)
+                chosen.append(i)
+        if len(chosen) < k:
+            remaining = [i for i in range(len(self.items)) if i not in seen]
+            chosen += rng.sample(remaining, k - len(chosen))
+        return [self.items[i] for i in chosen]
+
+def class_weights(counts):
+    """
+    Per-asset weight for each class: OVERSAMPLE_RULES, or derived from
+    CLASS_TARGET_DISTRIBUTION so each class gets its target share of draws.
+    """
+    if CLASS_TARGET_DISTRIBUTION is None:
+        return {label: OVERSAMPLE_RULES.get(label, 1) for label in counts}
+    return {label: CLASS_TARGET_DISTRIBUTION.get(label, 0) / n for label, n in counts.items() if n}
+
+def load_asset_exclusions():
+    """File names of the assets listed under "assets" in ASSET_EXCLUSIONS_PATH."""
+    if not ASSET_EXCLUSIONS_PATH.exists():
+        return set()
+    with open(ASSET_EXCLUSIONS_PATH, 'r') as f:
+        return set(json.load(f).get("assets", []))
+
+def load_asset_sampler(name_to_id):
     print("Loading assets...")
-    # Error handling if the JSON file is missing
-    if not JSON_INPUT_PATH.exists():
-        print(f"ERROR: {JSON_INPUT_PATH} not found!")
-        return []
+    pack = get_asset_pack()
+    if pack is not None:
+        # The pack index already holds labels and only contains existing files
+        print(f"Using asset pack {ASSET_PACK_PATH} ({len(pack)} assets).")
+        data = {filename: entry["label"] for filename, entry in pack.assets.items()}
+    else:
+        # Error handling if the JSON file is missing
+        if not JSON_INPUT_PATH.exists():
+            print(f"ERROR: {JSON_INPUT_PATH} not found!")
+            return []
 
-    with open(JSON_INPUT_PATH, 'r') as f:
-        data = json.load(f)
-    pool = []
-    
-    # Counter for debugging
-    counts = {k:0 for k in OVERSAMPLE_RULES.keys()}
+        with open(JSON_INPUT_PATH, 'r') as f:
+            data = json.load(f)
+    excluded = load_asset_exclusions()
+    assets = []
     
     for filename, label in data.items():
         if label not in name_to_id: continue
+        if Path(filename).name in excluded: continue
         
         # Path check (sometimes paths in the JSON differ from the filesystem)
         full_path = ASSET_DIR / filename
-        if not full_path.exists(): 
+        if pack is None and not full_path.exists(): 
             continue
             
-        factor = OVERSAMPLE_RULES.get(label, 1)
         item = {"path": str(full_path), "label": label, "class_id": name_to_id[label]}
-        
-        for _ in range(factor): 
-            pool.append(item)
-            if label in counts: counts[label] += 1
-            
-    print(f"Pool size: {len(pool)} assets.")
-    return pool
+        if pack is not None:
+            item["pack_key"] = filename
+        assets.append(item)
+
+    if excluded:
+        print(f"[Info] {len(excluded)} assets excluded by {ASSET_EXCLUSIONS_PATH}.")
+
+    counts = {}
+    for item in assets:
+        counts[item["label"]] = counts.get(item["label"], 0) + 1
+    weights = class_weights(counts)
+    assets = [item for item in assets if weights.get(item["label"], 0) > 0]
+    if not assets:
+        return []
+
+    # Expected share of drawn panels per class
+    total = sum(weights[label] * n for label, n in counts.items() if label in weights)
+    shares = ", ".join(f"{label}: {weights[label] * n / total:.1%}" for label, n in sorted(counts.items()) if label in weights)
+    print(f"Pool size: {len(assets)} unique assets ({shares}).")
+    return AliasSampler(assets, [weights[item["label"]] for item in assets])
+
+class AssetCache:
+    """
+    LRU cache of decoded full-size assets, bounded by a memory budget.
+    Key: asset path. Oversampled assets (Tables 20x, Images 10x) then skip the
+    PNG decode on repeated use; the resize is done per figure, since the slot
+    width changes with the random padding and gaps of every layout.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, path):
+        img = self._entries.get(path)
+        if img is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(path)
+        self.hits += 1
+        return img
+
+    def put(self, path, img):
+        if img.nbytes > self.max_bytes:
+            return
+        key = path
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key).nbytes
+        # Cached arrays are shared between figures, so they must never be modified
+        img.setflags(write=False)
+        self._entries[key] = img
+        self.current_bytes += img.nbytes
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self._entries), "bytes": self.current_bytes}
+
+_asset_cache = AssetCache(ASSET_CACHE_MB * 1024 * 1024)
+_asset_pack = None
+
+def get_asset_pack():
+    """
+    Opens ASSET_PACK_PATH once per process (memory-mapped), or returns None
+    if no pack has been built.
+    """
+    global _asset_pack
+    if _asset_pack is None and ASSET_PACK_PATH.exists():
+        _asset_pack = AssetPack(ASSET_PACK_PATH)
+    return _asset_pack
+
+def decode_asset(asset):
+    """
+    Returns the full-size BGR asset, sliced from the asset pack if possible.
+    """
+    if "pack_key" in asset:
+        pack = get_asset_pack()
+        if pack is not None and asset["pack_key"] in pack:
+            return pack.get(asset["pack_key"])
+    return cv2.imread(asset["path"])
+
+def record_stage(stage, t0):
+    if STAGE_TIMES is not None:
+        STAGE_TIMES.setdefault(stage, []).append(time.perf_counter() - t0)
+
+_asset_sizes = {}
 
-def get_random_grid():
+def asset_size(asset):
+    """
+    (width, height) of the full-size asset without decoding pixels:
+    from the asset pack index, or from the image header (memoized per process).
+    """
+    if "pack_key" in asset:
+        pack = get_asset_pack()
+        if pack is not None and asset["pack_key"] in pack:
+            h, w = pack.shape(asset["pack_key"])[:2]
+            return w, h
+    size = _asset_sizes.get(asset["path"])
+    if size is None:
+        try:
+            with Image.open(asset["path"]) as im:
+                size = im.size
+        except OSError:
+            # Same size as the white placeholder used for undecodable files
+            size = (100, 100)
+        _asset_sizes[asset["path"]] = size
+    return size
+
+def resized_height(asset, width):
+    # Resize to column width (keep aspect ratio)
+    w_img, h_img = asset_size(asset)
+    return int(h_img * width / w_img)
+
+def paste_asset(asset, dst, cache=None):
+    """
+    Fills `dst` (a canvas slot of the target size) with the resized asset.
+    The decoded asset comes from the cache (or is decoded and cached) and is
+    resized straight into `dst`.
+    """
+    if cache is None:
+        cache = _asset_cache
+    h, w = dst.shape[:2]
+    # "paste" covers the whole call (cache lookup, decode on a miss, resize)
+    paste_t0 = time.perf_counter()
+    img = cache.get(asset["path"])
+    if img is None:
+        t0 = time.perf_counter()
+        img = decode_asset(asset)
+        record_stage("decode", t0)
+        if img is None:
+            # Fallback: empty white image
+            dst[:] = 255
+            record_stage("paste", paste_t0)
+            return
+        # Pack slices are views of the memory map already, caching them would only use up the budget
+        if img.flags.owndata:
+            cache.put(asset["path"], img)
+    t0 = time.perf_counter()
+    cv2.resize(img, (w, h), dst=dst)
+    record_stage("resize", t0)
+    record_stage("paste", paste_t0)
+
+class CanvasPool:
+    """
+    Reusable canvas buffers for one process. acquire() blocks until a buffer
+    has been released again (by the writer, once the JPEG is encoded).
+    """
+    def __init__(self, size, width=PAGE_WIDTH):
+        self.width = width
+        self.allocations = 0
+        self._free = queue.LifoQueue()
+        for _ in range(size):
+            self._free.put(np.empty((0, width, 3), dtype=np.uint8))
+
+    def acquire(self, height):
+        buf = self._free.get()
+        if buf.shape[0] < height:
+            # Grow in 512px steps, so slightly taller figures do not reallocate every time
+            buf = np.empty((-(-height // 512) * 512, self.width, 3), dtype=np.uint8)
+            self.allocations += 1
+        return buf[:height]
+
+    def release(self, canvas):
+        self._free.put(canvas.base if canvas.base is not None else canvas)
+
+def image_rng(idx, seed=None):
+    """
+    Returns the RNG for one image index (default seed: SEED).
+    Seeding with a string is stable across processes (no hash randomization).
+    """
+    if seed is None:
+        seed = SEED
+    return random.Random(f"{seed}-{idx}")
+
+def get_random_grid(rng=random):
     grids, weights = zip(*GRID_CHOICES)
-    return random.choices(grids, weights=weights, k=1)[0]
+    return rng.choices(grids, weights=weights, k=1)[0]
+
+def render_compound(idx, asset_pool, rng=None, canvas_pool=None):
+    """
+    Composes one synthetic compound figure in memory.
+    Returns a dict with the canvas, YOLO boxes (tuples and label lines),
+    Label Studio labels and layout info, or None if the pool has too few assets for the drawn grid.
+    With a `canvas_pool`, the canvas is a pooled buffer that must be released after use.
+    """
+    if rng is None:
+        rng = image_rng(idx)
 
-def create_compound(idx, asset_pool):
-    rows, cols = get_random_grid()
+    rows, cols = get_random_grid(rng)
     num_slots = rows * cols
     
-    if len(asset_pool) < num_slots:
+    if UNIQUE_ASSETS_PER_FIGURE and len(asset_pool) < num_slots:
         return None
 
-    selection = random.sample(asset_pool, num_slots)
+    selection = asset_pool.sample(num_slots, rng, unique=UNIQUE_ASSETS_PER_FIGURE)
     
     # --- LAYOUT LOGIC: PAGE FLOW ---
     # Build the figure from top to bottom.
     
-    bg_gray = random.randint(245, 255) # Very light gray/white
+    bg_gray = rng.randint(245, 255) # Very light gray/white
     
     # Define margins
-    outer_pad = random.randint(20, 50)
-    gap_x = random.randint(10, 30)
-    gap_y = random.randint(20, 50)
+    outer_pad = rng.randint(20, 50)
+    gap_x = rng.randint(10, 30)
+    gap_y = rng.randint(20, 50)
     
     # Available width for content
     content_width = PAGE_WIDTH - (2 * outer_pad)
@@ -126,9 +442,10 @@ def create_compound(idx, asset_pool):
     col_width = int((content_width - ((cols - 1) * gap_x)) / cols)
     
     # First compute the final canvas height.
-    # We do this by simulating placement row by row.
+    # We do this by simulating placement row by row, using only the image
+    # sizes (no pixels are decoded before the canvas exists).
     
-    row_buffers = [] # Speichert (Image, LabelInfo) pro Zeile
+    row_buffers = [] # Speichert (Asset, LabelInfo) pro Zeile
     
     current_asset_idx = 0
     total_canvas_height = outer_pad
@@ -141,21 +458,11 @@ def create_compound(idx, asset_pool):
             asset = selection[current_asset_idx]
             current_asset_idx += 1
             
-            img = cv2.imread(asset["path"])
-            if img is None: 
-                # Fallback: create an empty white image
-                img = np.ones((100, 100, 3), dtype=np.uint8) * 255
-            
-            # Resize to column width (keep aspect ratio)
-            h_img, w_img = img.shape[:2]
-            scale = col_width / w_img
             new_w = col_width # Exakt Spaltenbreite
-            new_h = int(h_img * scale)
-            
-            resized = cv2.resize(img, (new_w, new_h))
+            new_h = resized_height(asset, col_width)
             
             row_items.append({
-                "img": resized,
+                "asset": asset,
                 "label": asset["label"],
                 "class_id": asset["class_id"],
                 "h": new_h,
@@ -177,8 +484,13 @@ def create_compound(idx, asset_pool):
     total_canvas_height = total_canvas_height - gap_y + outer_pad
     
     # --- CANVAS ERSTELLEN ---
-    canvas = np.ones((total_canvas_height, PAGE_WIDTH, 3), dtype=np.uint8) * bg_gray
+    if canvas_pool is not None:
+        canvas = canvas_pool.acquire(total_canvas_height)
+        canvas.fill(bg_gray)
+    else:
+        canvas = np.full((total_canvas_height, PAGE_WIDTH, 3), bg_gray, dtype=np.uint8)
     
+    boxes = []
     yolo_labels = []
     json_labels = []
     
@@ -190,7 +502,6 @@ def create_compound(idx, asset_pool):
         items = row_data["items"]
         
         for c, item in enumerate(items):
-            img = item["img"]
             h, w = item["h"], item["w"]
             
             # X Position
@@ -199,8 +510,8 @@ def create_compound(idx, asset_pool):
             # Y position (center within row for better alignment with varying heights)
             y_pos = current_y + (row_h - h) // 2
             
-            # Paste
-            canvas[y_pos:y_pos+h, x_pos:x_pos+w] = img
+            # Paste (resized directly into the canvas slot)
+            paste_asset(item["asset"], canvas[y_pos:y_pos+h, x_pos:x_pos+w])
             
             # --- LABELS ---
             # YOLO (Normalized)
@@ -209,6 +520,7 @@ def create_compound(idx, asset_pool):
             bw = w / PAGE_WIDTH
             bh = h / total_canvas_height
             
+            boxes.append((item["class_id"], cx, cy, bw, bh))
             yolo_labels.append(f"{item['class_id']} {cx:.6f} {cy:.6f} {bw:.6f} {bh:.6f}")
             
             # JSON (Pixel / Percentage)
@@ -225,39 +537,402 @@ def create_compound(idx, asset_pool):
             
         current_y += row_h + gap_y
 
+    return {
+        "canvas": canvas,
+        "boxes": boxes,
+        "yolo_labels": yolo_labels,
+        "json_labels": json_labels,
+        "layout": f"{rows}x{cols}",
+        "height": total_canvas_height
+    }
+
+def write_compound(canvas, img_path, label_text, lbl_path, sample=None):
+    """
+    Encodes the canvas and writes image + label file.
+    If `sample` is a dict, the encoded bytes are stored in it instead (shard output).
+    """
+    # Encode and write separately (same bytes as cv2.imwrite) so both can be timed
+    t0 = time.perf_counter()
+    ok, encoded = cv2.imencode(Path(img_path).suffix, canvas)
+    record_stage("encode", t0)
+    if not ok:
+        raise IOError(f"Encoding failed for {img_path}")
+    if sample is not None:
+        sample["jpg"] = encoded.tobytes()
+        sample["txt"] = label_text.encode("utf-8")
+        return
+    t0 = time.perf_counter()
+    encoded.tofile(str(img_path))
+    record_stage("image_write", t0)
+
+    t0 = time.perf_counter()
+    with open(lbl_path, "w") as f:
+        f.write(label_text)
+    record_stage("label_write", t0)
+
+class CompoundWriter:
+    """
+    Bounded producer/consumer stage for JPEG encoding and label writes.
+    OpenCV releases the GIL while encoding, so a few threads per process keep
+    the compositor from stalling on encoder and disk latency.
+    """
+    def __init__(self, num_threads=WRITER_THREADS, max_queue=WRITER_QUEUE_SIZE, canvas_pool=None):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.canvas_pool = canvas_pool
+        self._lock = threading.Lock()
+        self._errors = []
+        self.stats = {
+            "written": 0, "write_seconds": 0.0, "submit_wait_seconds": 0.0,
+            "depth_sum": 0, "depth_samples": 0, "depth_max": 0
+        }
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(num_threads)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, canvas, img_path, label_text, lbl_path, sample=None):
+        depth = self._queue.qsize()
+        t0 = time.perf_counter()
+        # Blocks while the queue is full (backpressure on the compositor)
+        self._queue.put((canvas, img_path, label_text, lbl_path, sample))
+        with self._lock:
+            self.stats["submit_wait_seconds"] += time.perf_counter() - t0
+            self.stats["depth_sum"] += depth
+            self.stats["depth_samples"] += 1
+            self.stats["depth_max"] = max(self.stats["depth_max"], depth)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            t0 = time.perf_counter()
+            try:
+                write_compound(*item)
+            except Exception as e:
+                self._errors.append(f"{item[1]}: {e}")
+            finally:
+                if self.canvas_pool is not None:
+                    self.canvas_pool.release(item[0])
+                with self._lock:
+                    self.stats["written"] += 1
+                    self.stats["write_seconds"] += time.perf_counter() - t0
+                self._queue.task_done()
+
+    def drain(self):
+        """Waits until every submitted figure is on disk."""
+        self._queue.join()
+        if self._errors:
+            errors, self._errors = self._errors, []
+            raise IOError(f"Writing failed for {len(errors)} file(s), e.g. {errors[0]}")
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+
+_compose_stats = {"composed": 0, "compose_seconds": 0.0, "by_layout": {}}
+
+def create_compound(idx, asset_pool, rng=None, writer=None, canvas_pool=None):
+    """
+    Renders one compound, saves image + YOLO label and returns the Label Studio task.
+    With a `writer`, saving happens asynchronously (call writer.drain() before
+    relying on the files). Pooled canvases go back to `canvas_pool` once written;
+    a writer must then have been created with the same pool.
+    """
+    t0 = time.perf_counter()
+    result = render_compound(idx, asset_pool, rng, canvas_pool=canvas_pool)
+    elapsed = time.perf_counter() - t0
+    _compose_stats["compose_seconds"] += elapsed
+    if result is None:
+        return None
+    _compose_stats["composed"] += 1
+    layout_stats = _compose_stats["by_layout"].setdefault(result["layout"], [0, 0.0])
+    layout_stats[0] += 1
+    layout_stats[1] += elapsed
+
     # Save
     filename = f"synth_{idx:06d}.jpg"
     out_img_path = OUT_IMG_DIR / filename
-    cv2.imwrite(str(out_img_path), canvas)
-    
-    with open(OUT_LBL_DIR / f"synth_{idx:06d}.txt", "w") as f:
-        f.write("\n".join(yolo_labels))
+    out_lbl_path = OUT_LBL_DIR / f"synth_{idx:06d}.txt"
+    label_text = "\n".join(result["yolo_labels"])
+    # Shard output: the encoded bytes travel back with the task, the main process writes the shards
+    sample = {} if OUTPUT_FORMAT == "shards" else None
+    if writer is None:
+        write_compound(result["canvas"], out_img_path, label_text, out_lbl_path, sample)
+        if canvas_pool is not None:
+            canvas_pool.release(result["canvas"])
+    else:
+        writer.submit(result["canvas"], out_img_path, label_text, out_lbl_path, sample)
         
-    return {
+    task = {
         "image": f"/data/local-files/?d={out_img_path.absolute()}",
         "id": 100000 + idx,
-        "label": json_labels,
+        "label": result["json_labels"],
         "annotator": 0,
         "created_at": datetime.now().isoformat(),
-        "meta": {"layout": f"{rows}x{cols}", "size": f"{PAGE_WIDTH}x{total_canvas_height}"}
+        "meta": {"layout": result["layout"], "size": f"{PAGE_WIDTH}x{result['height']}"}
     }
+    if sample is not None:
+        task["_shard_sample"] = sample
+    return task
+
+# --- PARALLEL GENERATION ---
+# Worker processes receive the asset pool once (initializer) instead of per task.
+_worker_pool = None
+
+# Settings read in worker processes. They are sent along with the pool, since spawned
+# workers (default on macOS/Windows) re-import this module and only see the defaults.
+WORKER_SETTINGS = ["SEED", "OUT_IMG_DIR", "OUT_LBL_DIR", "OUTPUT_FORMAT", "ASSET_PACK_PATH", "PAGE_WIDTH",
+                   "WRITER_THREADS", "WRITER_QUEUE_SIZE", "REUSE_CANVAS_BUFFERS", "ASSET_CACHE_MB",
+                   "UNIQUE_ASSETS_PER_FIGURE", "GRID_CHOICES"]
+
+def worker_settings(seed=None, out_img_dir=None, out_lbl_dir=None):
+    """Current values of WORKER_SETTINGS, with the seed and output folders overridden if given."""
+    settings = {name: globals()[name] for name in WORKER_SETTINGS}
+    if seed is not None:
+        settings["SEED"] = seed
+    if out_img_dir is not None:
+        settings["OUT_IMG_DIR"] = Path(out_img_dir)
+    if out_lbl_dir is not None:
+        settings["OUT_LBL_DIR"] = Path(out_lbl_dir)
+    return settings
+
+def _apply_settings(settings):
+    """Sets module settings and returns their previous values."""
+    previous = {name: globals()[name] for name in settings}
+    globals().update(settings)
+    return previous
+
+def _init_worker(asset_pool, num_workers=1, settings=None):
+    global _worker_pool, _writer, _canvas_pool, _asset_cache
+    if settings:
+        _apply_settings(settings)
+    _worker_pool = asset_pool
+    # One OpenCV thread per process, the pool already uses all cores
+    cv2.setNumThreads(1)
+    # A forked worker inherits the parent's writer without its threads, and its counters
+    _writer = None
+    _canvas_pool = None
+    # Each worker holds its share of the budget, so the total stays at ASSET_CACHE_MB
+    _asset_cache = AssetCache(ASSET_CACHE_MB * 1024 * 1024 // num_workers)
+    _compose_stats.update(composed=0, compose_seconds=0.0, by_layout={})
+
+_writer = None
+_canvas_pool = None
+
+def get_canvas_pool():
+    global _canvas_pool
+    if _canvas_pool is None and REUSE_CANVAS_BUFFERS:
+        # One canvas being composed, one per queue slot and one per writer thread
+        _canvas_pool = CanvasPool(WRITER_QUEUE_SIZE + WRITER_THREADS + 1)
+    return _canvas_pool
+
+def get_writer():
+    global _writer
+    if _writer is None and WRITER_THREADS > 0:
+        _writer = CompoundWriter(canvas_pool=get_canvas_pool())
+    return _writer
+
+def peak_rss_mb():
+    if resource is None:
+        return 0.0
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _generate_chunk(indices, asset_pool=None):
+    if asset_pool is None:
+        asset_pool = _worker_pool
+    writer = get_writer()
+    canvas_pool = get_canvas_pool()
+    tasks = [create_compound(i, asset_pool, writer=writer, canvas_pool=canvas_pool) for i in indices]
+    # Tasks are only returned (and journaled) once their files are on disk
+    if writer is not None:
+        writer.drain()
+    # Counters are cumulative per process; the parent keeps the latest per pid
+    stats = {
+        "cache": _asset_cache.stats(),
+        "compose": dict(_compose_stats),
+        "memory": {"peak_rss_mb": peak_rss_mb(),
+                   "canvas_allocations": canvas_pool.allocations if canvas_pool else 0}
+    }
+    if writer is not None:
+        stats["writer"] = dict(writer.stats)
+    return tasks, os.getpid(), stats
+
+def generate_tasks(asset_pool, indices, num_workers=None, chunk_size=None, process_stats=None,
+                   seed=None, out_img_dir=None, out_lbl_dir=None):
+    """
+    Yields the Label Studio task (or None) for every index, in index order.
+    If `process_stats` is a dict, it is filled with cache and pipeline stats per process.
+    seed, out_img_dir and out_lbl_dir override SEED, OUT_IMG_DIR and OUT_LBL_DIR for this run.
+    """
+    num_workers = num_workers or NUM_WORKERS
+    chunk_size = chunk_size or CHUNK_SIZE
+    indices = list(indices)
+    chunks = [indices[i:i + chunk_size] for i in range(0, len(indices), chunk_size)]
+    settings = worker_settings(seed, out_img_dir, out_lbl_dir)
+
+    if num_workers <= 1:
+        previous = _apply_settings(settings)
+        try:
+            results = (_generate_chunk(chunk, asset_pool) for chunk in chunks)
+            yield from _unpack_chunks(results, process_stats)
+        finally:
+            _apply_settings(previous)
+        return
+
+    with Pool(num_workers, initializer=_init_worker, initargs=(asset_pool, num_workers, settings)) as workers:
+        # imap keeps the input order, so results can be consumed as they arrive
+        yield from _unpack_chunks(workers.imap(_generate_chunk, chunks), process_stats)
+
+def _unpack_chunks(results, process_stats):
+    for tasks, pid, stats in results:
+        if process_stats is not None:
+            process_stats[pid] = stats
+        yield from tasks
+
+def _sum_stats(process_stats, group, key):
+    return sum(s[group][key] for s in process_stats.values() if group in s)
+
+def print_run_stats(process_stats, wall_seconds):
+    hits = _sum_stats(process_stats, "cache", "hits")
+    misses = _sum_stats(process_stats, "cache", "misses")
+    total_mb = _sum_stats(process_stats, "cache", "bytes") / (1024 * 1024)
+    hit_rate = hits / (hits + misses) if hits + misses else 0
+    print(f"Asset cache: {hits} hits / {misses} misses ({hit_rate:.1%} hit rate), "
+          f"{total_mb:.0f} MB in use over {len(process_stats)} process(es)")
+
+    composed = _sum_stats(process_stats, "compose", "composed")
+    compose_s = _sum_stats(process_stats, "compose", "compose_seconds")
+    print(f"Compose: {composed} images, {compose_s / max(composed, 1) * 1000:.1f} ms/image per process")
+    by_layout = {}
+    for s in process_stats.values():
+        for layout, (n, secs) in s["compose"]["by_layout"].items():
+            by_layout.setdefault(layout, [0, 0.0])
+            by_layout[layout][0] += n
+            by_layout[layout][1] += secs
+    print("         " + ", ".join(f"{layout}: {secs / n * 1000:.1f} ms" for layout, (n, secs) in sorted(by_layout.items())))
+
+    written = _sum_stats(process_stats, "writer", "written")
+    if written:
+        write_s = _sum_stats(process_stats, "writer", "write_seconds")
+        wait_s = _sum_stats(process_stats, "writer", "submit_wait_seconds")
+        samples = _sum_stats(process_stats, "writer", "depth_samples")
+        depth_avg = _sum_stats(process_stats, "writer", "depth_sum") / max(samples, 1)
+        depth_max = max(s["writer"]["depth_max"] for s in process_stats.values() if "writer" in s)
+        print(f"Write:   {written} images, {write_s / written * 1000:.1f} ms/image per thread, "
+              f"compositor blocked {wait_s:.1f}s on a full queue")
+        print(f"Queue:   avg depth {depth_avg:.1f}, max {depth_max} (limit {WRITER_QUEUE_SIZE})")
+    rss = [s["memory"]["peak_rss_mb"] for s in process_stats.values()]
+    allocations = _sum_stats(process_stats, "memory", "canvas_allocations")
+    if rss:
+        print(f"Memory:  peak RSS {max(rss):.0f} MB per process ({sum(rss):.0f} MB summed), "
+              f"main process {peak_rss_mb():.0f} MB, {allocations} canvas allocations")
+    if wall_seconds > 0:
+        print(f"Total:   {composed / wall_seconds:.1f} images/s over {wall_seconds:.0f}s")
+
+# --- STREAMING OUTPUT & RESUME ---
+
+def read_task_journal(jsonl_path):
+    """
+    Reads all tasks from the JSONL journal.
+    A truncated last line (crash while writing) is skipped.
+    """
+    tasks = []
+    if not Path(jsonl_path).exists():
+        return tasks
+    with open(jsonl_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try:
+                tasks.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"[Warning] Skipping broken line in {jsonl_path}")
+    return tasks
+
+def _synth_indices(directory, suffix):
+    pattern = re.compile(rf"synth_(\d{{6}}){re.escape(suffix)}$")
+    if not directory.exists():
+        return set()
+    with os.scandir(directory) as entries:
+        return {int(m.group(1)) for e in entries if (m := pattern.match(e.name))}
+
+def find_completed_indices():
+    """
+    Indices for which the image, the YOLO label and the JSONL task all exist.
+    Everything else is regenerated (bit-identical thanks to the per-index seed).
+    """
+    journaled = {task["id"] - 100000 for task in read_task_journal(OUT_JSONL_FILE)}
+    if OUTPUT_FORMAT == "shards":
+        sharded = {int(key[len("synth_"):]) for key in ShardReader(OUT_SHARD_DIR).keys()}
+        return sharded & journaled
+    return _synth_indices(OUT_IMG_DIR, ".jpg") & _synth_indices(OUT_LBL_DIR, ".txt") & journaled
+
+def open_task_journal(resume):
+    if not resume:
+        return open(OUT_JSONL_FILE, "w")
+    needs_newline = False
+    if OUT_JSONL_FILE.exists() and OUT_JSONL_FILE.stat().st_size > 0:
+        with open(OUT_JSONL_FILE, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    journal = open(OUT_JSONL_FILE, "a")
+    # Terminate a partially written last line so the next task starts on its own line
+    if needs_newline:
+        journal.write("\n")
+    return journal
+
+def compact_task_journal(jsonl_path=None, json_path=None):
+    """
+    Writes the Label Studio JSON from the journal (index order, last entry per id wins).
+    """
+    jsonl_path = jsonl_path or OUT_JSONL_FILE
+    json_path = json_path or OUT_JSON_FILE
+    tasks = {task["id"]: task for task in read_task_journal(jsonl_path)}
+    tmp_path = Path(json_path).with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump([tasks[k] for k in sorted(tasks)], f, indent=2)
+    os.replace(tmp_path, json_path)
+    print(f"Compacted {len(tasks)} tasks into {json_path}")
 
 def main():
     name_to_id = setup_directories()
-    pool = load_and_oversample_assets(name_to_id)
+    pool = load_asset_sampler(name_to_id)
     if not pool: 
         print("Abort: no assets in the pool.")
         return
 
-    all_tasks = []
-    print(f"--- START GENERATION: {NUM_IMAGES_TO_GENERATE} IMAGES ---")
+    completed = find_completed_indices() if RESUME else set()
+    indices = [i for i in range(NUM_IMAGES_TO_GENERATE) if i not in completed]
+    if completed:
+        print(f"[Info] Resuming: {len(completed)} images already done, {len(indices)} missing.")
+
+    print(f"--- START GENERATION: {len(indices)} IMAGES ({NUM_WORKERS} workers) ---")
     
-    for i in tqdm(range(NUM_IMAGES_TO_GENERATE)):
-        task = create_compound(i, pool)
-        if task: all_tasks.append(task)
+    process_stats = {}
+    start = time.perf_counter()
+    shards = ShardWriter(OUT_SHARD_DIR) if OUTPUT_FORMAT == "shards" else None
+    with open_task_journal(RESUME) as journal:
+        for n, task in enumerate(tqdm(generate_tasks(pool, indices, process_stats=process_stats), total=len(indices))):
+            if not task: continue
+            sample = task.pop("_shard_sample", None)
+            if shards is not None:
+                key = f"synth_{task['id'] - 100000:06d}"
+                shards.write(key, {"jpg": sample["jpg"], "txt": sample["txt"], "json": json.dumps(task)})
+                if n % CHUNK_SIZE == CHUNK_SIZE - 1:
+                    shards.flush()
+            journal.write(json.dumps(task) + "\n")
+            journal.flush()
+    if shards is not None:
+        shards.close()
+
+    print_run_stats(process_stats, time.perf_counter() - start)
             
-    with open(OUT_JSON_FILE, "w") as f:
-        json.dump(all_tasks, f, indent=2)
+    if COMPACT_JSON:
+        compact_task_journal()
     print("Done!")
 
 if __name__ == "__main__":
@@ -0,0 +1,293 @@
+import argparse
+import json
+import math
+import os
+import time
+import cv2
+import numpy as np
+from multiprocessing import Pool
+from pathlib import Path
+from tqdm import tqdm
+
+try:
+    from DatasetAssembler import OUTPUT_DIR, SPLITS
+except ImportError:  # Imported as utils.TrainingImageCache (notebooks)
+    from utils.DatasetAssembler import OUTPUT_DIR, SPLITS
+
+# --- KONFIGURATION ---
+IMGSZ = 960                 # Same as the training run (compound_yolo11s_960_optimized)
+STRIDE = 32                 # Padded sides are multiples of the model stride
+PAD_COLOR = (114, 114, 114) # Ultralytics letterbox gray
+CACHE_DIR_NAME = "cache"    # <dataset>/cache/<imgsz>/
+
+def label_path_for(img_path):
+    """images/<split>/x.jpg -> labels/<split>/x.txt (last 'images' folder in the path)."""
+    parts = list(Path(img_path).parts)
+    idx = len(parts) - 1 - parts[::-1].index("images")
+    parts[idx] = "labels"
+    return Path(*parts).with_suffix(".txt")
+
+def letterbox(img, imgsz=IMGSZ, stride=STRIDE, square=False):
+    """
+    Scales the longer side to imgsz (aspect ratio kept) and pads centered with
+    PAD_COLOR to a multiple of stride, or to imgsz x imgsz if square.
+    Returns (image, scale, (pad_left, pad_top)).
+    """
+    h, w = img.shape[:2]
+    scale = imgsz / max(h, w)
+    new_w, new_h = max(1, round(w * scale)), max(1, round(h * scale))
+    if (new_w, new_h) != (w, h):
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        img = cv2.resize(img, (new_w, new_h), interpolation=interpolation)
+    if square:
+        out_w = out_h = imgsz
+    else:
+        out_w, out_h = math.ceil(new_w / stride) * stride, math.ceil(new_h / stride) * stride
+    left, top = (out_w - new_w) // 2, (out_h - new_h) // 2
+    img = cv2.copyMakeBorder(img, top, out_h - new_h - top, left, out_w - new_w - left,
+                             cv2.BORDER_CONSTANT, value=PAD_COLOR)
+    return np.ascontiguousarray(img), scale, (left, top)
+
+def read_yolo_labels(lbl_path):
+    """(N, 5) float32 array of class, cx, cy, w, h (broken lines are skipped)."""
+    rows = []
+    if lbl_path.exists():
+        with open(lbl_path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                try:
+                    rows.append([float(v) for v in parts[:5]] if len(parts) >= 5 else None)
+                except ValueError:
+                    continue
+    return np.array([r for r in rows if r is not None], dtype=np.float32).reshape(-1, 5)
+
+def rescale_labels(labels, orig_shape, new_shape, scale, pad):
+    """Normalized boxes of the original image -> normalized boxes of the letterboxed image."""
+    h, w = orig_shape[:2]
+    out_h, out_w = new_shape[:2]
+    labels = labels.copy()
+    labels[:, 1] = (labels[:, 1] * w * scale + pad[0]) / out_w
+    labels[:, 2] = (labels[:, 2] * h * scale + pad[1]) / out_h
+    labels[:, 3] *= w * scale / out_w
+    labels[:, 4] *= h * scale / out_h
+    return labels
+
+def _prepare_image(args):
+    img_path, imgsz, stride, square = args
+    img = cv2.imread(img_path)
+    if img is None:
+        return None
+    boxed, scale, pad = letterbox(img, imgsz, stride, square)
+    labels = rescale_labels(read_yolo_labels(label_path_for(img_path)), img.shape, boxed.shape, scale, pad)
+    return boxed, labels, list(img.shape[:2]), scale, pad
+
+def read_split_list(dataset_dir, split):
+    """Unique image paths of a split list (train.txt repeats oversampled images), in first-seen order."""
+    list_path = Path(dataset_dir) / f"{split}.txt"
+    if not list_path.exists():
+        return []
+    with open(list_path, 'r') as f:
+        return list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+def _file_signature(path):
+    """[path, mtime_ns, size], or [path, None, None] if the file does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return [str(path), None, None]
+    return [str(path), st.st_mtime_ns, st.st_size]
+
+def _sources_signature(paths):
+    # Images and their label files: relabeling alone must invalidate the cache too
+    return [_file_signature(path) + _file_signature(label_path_for(path)) for path in paths]
+
+def _remove_old_versions(cache_dir, split, keep):
+    # Previous versions and leftovers of interrupted builds (open memory maps stay valid)
+    for pattern in (f"{split}.bin", f"{split}.*.bin", f"{split}.labels.npy", f"{split}.*.labels.npy"):
+        for path in cache_dir.glob(pattern):
+            if path.name not in keep:
+                path.unlink(missing_ok=True)
+
+def build_training_cache(dataset_dir=None, imgsz=IMGSZ, stride=STRIDE, square=False, splits=None, num_workers=None):
+    """
+    Letterboxes every image of the split lists once and stores the pixels of each
+    split in one uint8 file (`<split>.<version>.bin`) with a JSON index (`<split>.json`:
+    offset, shape, scale, padding per image) and the rescaled labels
+    (`<split>.<version>.labels.npy`: image index, class, cx, cy, w, h).
+    A rebuild writes a new version and swaps the index last, so an interrupted
+    build leaves the previous cache intact.
+    A split is skipped if its images and label files (path, mtime, size) and the
+    settings are unchanged. Missing images are skipped with a warning.
+    """
+    dataset_dir = Path(dataset_dir or OUTPUT_DIR)
+    cache_dir = dataset_dir / CACHE_DIR_NAME / str(imgsz)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    settings = {"imgsz": imgsz, "stride": stride, "square": square}
+
+    for split in splits or SPLITS:
+        paths = read_split_list(dataset_dir, split)
+        if not paths:
+            print(f"[Warning] No images listed for {split}, skipping.")
+            continue
+        signature = _sources_signature(paths)
+        index_path = cache_dir / f"{split}.json"
+        if index_path.exists():
+            with open(index_path, 'r') as f:
+                old = json.load(f)
+            if old.get("settings") == settings and old.get("sources") == signature:
+                print(f"[Info] Cache for {split} is up to date ({len(paths)} images).")
+                continue
+
+        version = f"{time.time_ns():x}"
+        data_path = cache_dir / f"{split}.{version}.bin"
+        labels_path = cache_dir / f"{split}.{version}.labels.npy"
+        images, labels = [], []
+        offset = 0
+        jobs = [(path, imgsz, stride, square) for path in paths]
+        with Pool(num_workers or os.cpu_count()) as workers, open(data_path, "wb") as out:
+            prepared = workers.imap(_prepare_image, jobs, chunksize=4)
+            for path, result in tqdm(zip(paths, prepared), total=len(paths), desc=f"Caching {split}"):
+                if result is None:
+                    print(f"[Warning] Could not decode {path}, skipping.")
+                    continue
+                img, img_labels, orig_shape, scale, pad = result
+                out.write(img.data)
+                image_idx = len(images)
+                images.append({
+                    "name": Path(path).name,
+                    "source": path,
+                    "offset": offset,
+                    "shape": list(img.shape),
+                    "orig_shape": orig_shape,
+                    "scale": scale,
+                    "pad": list(pad),
+                })
+                labels.append(np.hstack([np.full((len(img_labels), 1), image_idx, np.float32), img_labels]))
+                offset += img.nbytes
+        np.save(labels_path, np.vstack(labels) if labels else np.zeros((0, 6), np.float32))
+
+        # Index last (atomically): it switches readers to the new version
+        tmp_index_path = cache_dir / f"{split}.json.tmp"
+        with open(tmp_index_path, "w") as f:
+            json.dump({"settings": settings, "sources": signature, "images": images,
+                       "data_file": data_path.name, "labels_file": labels_path.name}, f)
+        os.replace(tmp_index_path, index_path)
+        _remove_old_versions(cache_dir, split, keep=(data_path.name, labels_path.name))
+        print(f"[Info] {split}: {len(images)} images, {offset / 1024**3:.2f} GB in {data_path}")
+    return cache_dir
+
+class TrainingImageCache:
+    """
+    Read-only view on one cached split. Pixels are memory-mapped, so dataloader
+    workers share the page cache instead of holding decoded copies in RAM.
+    """
+    def __init__(self, dataset_dir=None, split="train", imgsz=IMGSZ):
+        cache_dir = Path(dataset_dir or OUTPUT_DIR) / CACHE_DIR_NAME / str(imgsz)
+        with open(cache_dir / f"{split}.json", 'r') as f:
+            index = json.load(f)
+        self.settings = index["settings"]
+        self.images = index["images"]
+        self.data_path = cache_dir / index.get("data_file", f"{split}.bin")
+        labels = np.load(cache_dir / index.get("labels_file", f"{split}.labels.npy"))
+        # Boxes of image i: self.labels[self._bounds[i]:self._bounds[i + 1]]
+        image_ids = labels[:, 0].astype(np.int64)
+        order = np.argsort(image_ids, kind="stable")
+        self.labels = labels[order, 1:]
+        self._bounds = np.searchsorted(image_ids[order], np.arange(len(self.images) + 1))
+        self._by_name = {entry["name"]: i for i, entry in enumerate(self.images)}
+        self._data = None
+
+    def _mapped(self):
+        # Opened lazily so the cache can be pickled to worker processes cheaply
+        if self._data is None:
+            self._data = np.memmap(self.data_path, dtype=np.uint8, mode="r")
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def __len__(self):
+        return len(self.images)
+
+    def index_of(self, name):
+        return self._by_name[name]
+
+    def __getitem__(self, i):
+        """(letterboxed BGR image (read-only view), (N, 5) labels: class, cx, cy, w, h)."""
+        entry = self.images[i]
+        h, w, c = entry["shape"]
+        start = entry["offset"]
+        img = self._mapped()[start:start + h * w * c].reshape(h, w, c)
+        return img, self.labels[self._bounds[i]:self._bounds[i + 1]]
+
+def cached_detection_trainer(imgsz=IMGSZ):
+    """
+    ultralytics DetectionTrainer class whose datasets take the pixels and labels
+    of the split from the cache (build_training_cache at the same imgsz) instead
+    of decoding and resizing every image in every epoch, e.g.
+
+        model = YOLO("yolo11s.pt")
+        model.train(data=".../04_model_ready/data.yaml", imgsz=960,
+                    trainer=cached_detection_trainer(960))
+
+    Images missing from the cache (stale cache) are loaded as usual.
+    """
+    from ultralytics.data.dataset import YOLODataset
+    from ultralytics.models.yolo.detect import DetectionTrainer
+
+    class CachedYOLODataset(YOLODataset):
+        def attach_cache(self, image_cache):
+            self.image_cache = image_cache
+            self.cached = [image_cache._by_name.get(Path(f).name) for f in self.im_files]
+            # Labels of the letterboxed image; augmentations start from the cached pixels
+            for label, j in zip(self.labels, self.cached):
+                if j is None:
+                    continue
+                boxes = image_cache[j][1]
+                label["cls"] = boxes[:, :1].copy()
+                label["bboxes"] = boxes[:, 1:].copy()
+                label["shape"] = tuple(image_cache.images[j]["shape"][:2])
+                label["segments"] = []
+                label.pop("keypoints", None)
+
+        def load_image(self, i, rect_mode=True):
+            j = self.cached[i]
+            if j is None:
+                return super().load_image(i, rect_mode)
+            img = self.image_cache[j][0].copy()  # Augmentations write into it, the map is read-only
+            if self.augment:
+                # Mosaic draws its partner images from this buffer
+                self.buffer.append(i)
+                if len(self.buffer) > self.max_buffer_length:
+                    self.buffer.pop(0)
+            return img, img.shape[:2], img.shape[:2]
+
+    class CachedDetectionTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode="train", batch=None):
+            dataset = super().build_dataset(img_path, mode, batch)
+            dataset_dir, split = Path(img_path).parent, Path(img_path).stem
+            if not (dataset_dir / CACHE_DIR_NAME / str(imgsz) / f"{split}.json").exists():
+                print(f"[Warning] No training cache for {split} at imgsz {imgsz}, decoding images.")
+                return dataset
+            # ultralytics builds its own YOLODataset, it only gains the cache here
+            dataset.__class__ = CachedYOLODataset
+            dataset.attach_cache(TrainingImageCache(dataset_dir, split, imgsz))
+            print(f"[Info] {split}: {sum(j is not None for j in dataset.cached)}/{len(dataset.cached)} images from the cache.")
+            return dataset
+
+    return CachedDetectionTrainer
+
+def main():
+    parser = argparse.ArgumentParser(description="Letterbox the assembled splits once into memory-mapped caches.")
+    parser.add_argument("--dataset", type=Path, default=OUTPUT_DIR)
+    parser.add_argument("--imgsz", type=int, default=IMGSZ)
+    parser.add_argument("--square", action="store_true", help="Pad to imgsz x imgsz instead of the next stride multiple.")
+    parser.add_argument("--splits", nargs="+", default=SPLITS)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    build_training_cache(args.dataset, args.imgsz, STRIDE, args.square, args.splits, args.workers)
+
+if __name__ == "__main__":
+    main()
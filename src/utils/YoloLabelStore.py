@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+import numpy as np
+from multiprocessing import Pool
+from pathlib import Path
+from tqdm import tqdm
+
+try:
+    from DatasetAssembler import MANIFEST_FILE, OUTPUT_DIR, REAL_LBL_DIR, SPLITS, SYNTH_LBL_DIR, DirectoryIndex
+    from SyntheticCompoundGenerator import LABEL_STUDIO_MAPPING
+except ImportError:  # Imported as utils.YoloLabelStore (notebooks)
+    from utils.DatasetAssembler import MANIFEST_FILE, OUTPUT_DIR, REAL_LBL_DIR, SPLITS, SYNTH_LBL_DIR, DirectoryIndex
+    from utils.SyntheticCompoundGenerator import LABEL_STUDIO_MAPPING
+
+# --- KONFIGURATION ---
+STORE_PATH = OUTPUT_DIR / "labels.npz"
+SOURCES = ["real", "synth"]
+SPLIT_NAMES = SPLITS + ["unassigned"]
+PARSE_CHUNK = 256           # Label files per worker task
+# Boxes smaller than this (normalized area) or thinner than MIN_SIDE count as degenerate
+MIN_AREA = 1e-5
+MIN_SIDE = 1e-3
+EDGE_TOLERANCE = 1e-3       # Allowed overshoot of box edges beyond the image
+
+BOX_DTYPE = np.dtype([
+    ("image_id", np.int32),
+    ("cls", np.int16),
+    ("cx", np.float32), ("cy", np.float32), ("w", np.float32), ("h", np.float32),
+    ("source", np.int8),
+    ("split", np.int8),
+])
+
+def _parse_label_chunk(chunk):
+    """
+    Worker: parses (image_id, path) pairs.
+    Returns (image_id, cls, cx, cy, w, h) rows and the number of broken lines per image.
+    """
+    rows = []
+    broken = []
+    for image_id, path in chunk:
+        bad = 0
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if not parts: continue
+                try:
+                    cls = int(parts[0])
+                    cx, cy, w, h = map(float, parts[1:5])
+                except (ValueError, IndexError):
+                    bad += 1
+                    continue
+                rows.append((image_id, cls, cx, cy, w, h))
+        broken.append((image_id, bad))
+    return rows, broken
+
+def collect_label_files(output_dir=None):
+    """
+    [(name, label path, source, split), ...] of the assembled dataset (assembly
+    manifest), or of the raw real/synthetic label folders (split "unassigned")
+    if nothing has been assembled yet.
+    """
+    output_dir = Path(output_dir or OUTPUT_DIR)
+    manifest_path = output_dir / MANIFEST_FILE
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        files = []
+        for key, split in sorted(manifest["splits"].items()):
+            source, stem = key.split("/", 1)
+            rel = f"labels/{split}/{stem}.txt"
+            if rel in manifest["files"]:
+                files.append((stem, str(output_dir / rel), source, split))
+        return files
+
+    print(f"[Info] No assembly manifest in {output_dir}, reading the raw label folders.")
+    files = []
+    for source, lbl_dir in (("real", REAL_LBL_DIR), ("synth", SYNTH_LBL_DIR)):
+        index = DirectoryIndex([lbl_dir], [".txt"])
+        files += [(stem, str(index.find(stem)), source, "unassigned") for stem in index.stems() if stem != "classes"]
+    return files
+
+def build_label_store(output_dir=None, store_path=None, num_workers=None):
+    """
+    Parses all label files (in parallel) into one structured array and saves it as .npz:
+    boxes (BOX_DTYPE), per image: images (names), image_source, image_split, broken_lines,
+    plus the class, source and split names.
+    """
+    store_path = Path(store_path or STORE_PATH)
+    files = collect_label_files(output_dir)
+    print(f"Parsing {len(files)} label files...")
+
+    jobs = [(image_id, path) for image_id, (_, path, _, _) in enumerate(files)]
+    chunks = [jobs[i:i + PARSE_CHUNK] for i in range(0, len(jobs), PARSE_CHUNK)]
+    rows, broken_lines = [], np.zeros(len(files), dtype=np.int32)
+    with Pool(num_workers or os.cpu_count()) as workers:
+        for chunk_rows, chunk_broken in tqdm(workers.imap(_parse_label_chunk, chunks), total=len(chunks), desc="Parsing"):
+            rows.extend(chunk_rows)
+            for image_id, bad in chunk_broken:
+                broken_lines[image_id] = bad
+
+    image_source = np.array([SOURCES.index(source) for _, _, source, _ in files], dtype=np.int8)
+    image_split = np.array([SPLIT_NAMES.index(split) for _, _, _, split in files], dtype=np.int8)
+
+    boxes = np.zeros(len(rows), dtype=BOX_DTYPE)
+    if rows:
+        columns = np.array(rows, dtype=np.float64)
+        boxes["image_id"] = columns[:, 0]
+        boxes["cls"] = columns[:, 1]
+        for i, field in enumerate(("cx", "cy", "w", "h"), start=2):
+            boxes[field] = columns[:, i]
+        boxes["source"] = image_source[boxes["image_id"]]
+        boxes["split"] = image_split[boxes["image_id"]]
+
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(store_path, boxes=boxes,
+             images=np.array([name for name, _, _, _ in files]),
+             image_source=image_source, image_split=image_split, broken_lines=broken_lines,
+             class_names=np.array([item['name'] for item in sorted(LABEL_STUDIO_MAPPING, key=lambda item: item['id'])]),
+             source_names=np.array(SOURCES), split_names=np.array(SPLIT_NAMES))
+    print(f"Done! {len(boxes)} boxes of {len(files)} images saved to {store_path}")
+    return LabelStore(store_path)
+
+class LabelStore:
+    """
+    All YOLO boxes of the dataset in one structured array, with vectorized reports.
+    Filter with the masks, e.g. store.boxes[store.mask(split="train", source="real")].
+    """
+    def __init__(self, store_path=None):
+        with np.load(store_path or STORE_PATH) as data:
+            self.boxes = data["boxes"]
+            self.images = data["images"]
+            self.image_source = data["image_source"]
+            self.image_split = data["image_split"]
+            self.broken_lines = data["broken_lines"]
+            self.class_names = list(data["class_names"])
+            self.source_names = list(data["source_names"])
+            self.split_names = list(data["split_names"])
+
+    @property
+    def num_classes(self):
+        return max(len(self.class_names), int(self.boxes["cls"].max()) + 1 if len(self.boxes) else 0)
+
+    def class_name(self, cls):
+        return self.class_names[cls] if 0 <= cls < len(self.class_names) else f"#{cls}"
+
+    def mask(self, split=None, source=None, boxes=None):
+        boxes = self.boxes if boxes is None else boxes
+        mask = np.ones(len(boxes), dtype=bool)
+        if split is not None:
+            mask &= boxes["split"] == self.split_names.index(split)
+        if source is not None:
+            mask &= boxes["source"] == self.source_names.index(source)
+        return mask
+
+    def class_counts(self, by="split"):
+        """Instances per class (rows) and split or source (columns)."""
+        names = self.split_names if by == "split" else self.source_names
+        flat = self.boxes[by].astype(np.int64) * self.num_classes + self.boxes["cls"]
+        valid = self.boxes["cls"] >= 0
+        counts = np.bincount(flat[valid], minlength=len(names) * self.num_classes)
+        return counts.reshape(len(names), self.num_classes).T
+
+    def images_with_class(self, split=None):
+        """Number of images containing each class at least once."""
+        boxes = self.boxes[self.mask(split=split) & (self.boxes["cls"] >= 0)]
+        pairs = np.unique(boxes["image_id"].astype(np.int64) * self.num_classes + boxes["cls"])
+        return np.bincount(pairs % self.num_classes, minlength=self.num_classes)
+
+    def empty_images(self):
+        """Images without any box, per split."""
+        has_boxes = np.zeros(len(self.images), dtype=bool)
+        has_boxes[self.boxes["image_id"]] = True
+        return np.bincount(self.image_split[~has_boxes], minlength=len(self.split_names))
+
+    def shape_percentiles(self, split=None, q=(5, 50, 95)):
+        """Per class: (count, area percentiles, aspect ratio w/h percentiles)."""
+        boxes = self.boxes[self.mask(split=split)]
+        area = boxes["w"] * boxes["h"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            aspect = boxes["w"] / boxes["h"]
+        result = {}
+        for cls in np.unique(boxes["cls"]):
+            sel = (boxes["cls"] == cls) & np.isfinite(aspect)
+            if not sel.any(): continue
+            result[int(cls)] = (int(sel.sum()), np.percentile(area[sel], q), np.percentile(aspect[sel], q))
+        return result
+
+    def invalid_boxes(self):
+        """
+        Boolean masks over all boxes: out_of_range (center outside the image, size
+        outside (0, 1] or edges beyond the image), degenerate (tiny or thin) and
+        unknown_class.
+        """
+        b = self.boxes
+        x0, x1 = b["cx"] - b["w"] / 2, b["cx"] + b["w"] / 2
+        y0, y1 = b["cy"] - b["h"] / 2, b["cy"] + b["h"] / 2
+        out_of_range = (
+            (b["cx"] < 0) | (b["cx"] > 1) | (b["cy"] < 0) | (b["cy"] > 1)
+            | (b["w"] <= 0) | (b["w"] > 1) | (b["h"] <= 0) | (b["h"] > 1)
+            | (x0 < -EDGE_TOLERANCE) | (x1 > 1 + EDGE_TOLERANCE) | (y0 < -EDGE_TOLERANCE) | (y1 > 1 + EDGE_TOLERANCE)
+        )
+        degenerate = (b["w"] * b["h"] < MIN_AREA) | (b["w"] < MIN_SIDE) | (b["h"] < MIN_SIDE)
+        unknown_class = (b["cls"] < 0) | (b["cls"] >= len(self.class_names))
+        return {"out_of_range": out_of_range, "degenerate": degenerate, "unknown_class": unknown_class}
+
+    def rebalance_factors(self, target_shares, split="train"):
+        """
+        Oversampling factor per class name so that the instance shares in `split`
+        reach target_shares ({class name: share}), relative to the least boosted class.
+        """
+        counts = self.class_counts()[:, self.split_names.index(split)].astype(np.float64)
+        shares = counts / max(counts.sum(), 1)
+        factors = {}
+        for name, target in target_shares.items():
+            cls = self.class_names.index(name)
+            factors[name] = float(target / shares[cls]) if shares[cls] else float("inf")
+        finite = [f for f in factors.values() if np.isfinite(f) and f > 0]
+        base = min(finite) if finite else 1.0
+        return {name: f / base for name, f in factors.items()}
+
+    def print_report(self, max_examples=5):
+        splits = [i for i, name in enumerate(self.split_names) if (self.image_split == i).any()]
+        counts = self.class_counts()
+        images = self.images_with_class()
+
+        print(f"\n=== {len(self.boxes)} BOXES IN {len(self.images)} IMAGES ===")
+        header = "".join(f"{self.split_names[s]:>11}" for s in splits)
+        print(f"{'class':<16}{header}{'images':>11}")
+        for cls in range(self.num_classes):
+            row = "".join(f"{counts[cls, s]:>11}" for s in splits)
+            print(f"{self.class_name(cls):<16}{row}{images[cls]:>11}")
+        empty = self.empty_images()
+        print(f"{'(no boxes)':<16}" + "".join(f"{empty[s]:>11}" for s in splits))
+
+        print("\n=== BOX SHAPES (p5 / p50 / p95) ===")
+        for cls, (n, area, aspect) in sorted(self.shape_percentiles().items()):
+            print(f"{self.class_name(cls):<16} n={n:<7} area {area[0]:.4f} / {area[1]:.4f} / {area[2]:.4f}"
+                  f" | aspect {aspect[0]:.2f} / {aspect[1]:.2f} / {aspect[2]:.2f}")
+
+        print("\n=== CHECKS ===")
+        for name, mask in self.invalid_boxes().items():
+            bad_images = np.unique(self.boxes["image_id"][mask])
+            examples = ", ".join(str(self.images[i]) for i in bad_images[:max_examples])
+            print(f"{name:<14} {int(mask.sum()):>6} boxes in {len(bad_images):>5} images" + (f" (e.g. {examples})" if examples else ""))
+        broken = np.flatnonzero(self.broken_lines)
+        print(f"{'broken_lines':<14} {int(self.broken_lines.sum()):>6} lines in {len(broken):>5} images"
+              + (f" (e.g. {', '.join(str(self.images[i]) for i in broken[:max_examples])})" if len(broken) else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and report the array-backed YOLO label store.")
+    parser.add_argument("--dataset", type=Path, default=OUTPUT_DIR, help="Assembled dataset (with assembly manifest).")
+    parser.add_argument("--store", type=Path, default=None, help=f"Output .npz (default: <dataset>/{STORE_PATH.name}).")
+    parser.add_argument("--rebuild", action="store_true", help="Parse the label files even if the store is up to date.")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    store_path = args.store or args.dataset / STORE_PATH.name
+    manifest_path = args.dataset / MANIFEST_FILE
+    stale = not store_path.exists() or (manifest_path.exists() and manifest_path.stat().st_mtime > store_path.stat().st_mtime)
+    store = build_label_store(args.dataset, store_path, args.workers) if args.rebuild or stale else LabelStore(store_path)
+    store.print_report()
+
+if __name__ == "__main__":
+    main()
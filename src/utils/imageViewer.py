@@ -1,11 +1,43 @@
 import streamlit as st
+import io
 import os
 import sys
 from PIL import Image
+from ShardedArchive import IMAGE_EXTENSIONS, ShardReader
 
 # Set page config
 st.set_page_config(layout="wide", page_title="Image Viewer")
 
+def shard_signature(directory):
+    """(name, mtime_ns, size) of the shard indexes, changes whenever shards are added or flushed."""
+    if not os.path.isdir(directory):
+        return ()
+    with os.scandir(directory) as entries:
+        return tuple(sorted((e.name, e.stat().st_mtime_ns, e.stat().st_size)
+                            for e in entries if e.name.endswith('.json') and e.is_file()))
+
+@st.cache_resource(max_entries=4)
+def load_shards(directory, signature=()):
+    """
+    Returns a ShardReader if the directory holds tar shards (ShardedArchive.py), else None.
+    signature (shard_signature) is part of the cache key, so shards written later are picked up.
+    """
+    if not os.path.isdir(directory):
+        return None
+    prefixes = sorted({f.rsplit('-', 1)[0] for f in os.listdir(directory)
+                       if f.endswith('.json') and f.rsplit('-', 1)[-1][:-5].isdigit()})
+    for prefix in prefixes:
+        reader = ShardReader(directory, prefix)
+        if len(reader):
+            return reader
+    return None
+
+def open_image(folder_path, image_name, shards):
+    if shards is None:
+        return Image.open(os.path.join(folder_path, image_name))
+    ext = next(e for e in IMAGE_EXTENSIONS if e in shards.members(image_name))
+    return Image.open(io.BytesIO(shards.read(image_name, ext)))
+
 def load_images(directory):
     valid_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
     if not os.path.exists(directory):
@@ -38,7 +70,8 @@ def main():
         st.error(f"Directory not found: {folder_path}")
         return
 
-    images = load_images(folder_path)
+    shards = load_shards(folder_path, shard_signature(folder_path))
+    images = sorted(shards.keys()) if shards is not None else load_images(folder_path)
     
     if not images:
         st.warning("No images found in the directory.")
@@ -73,12 +106,11 @@ def main():
 
     # Display current image
     current_image_file = images[st.session_state.image_index]
-    image_path = os.path.join(folder_path, current_image_file)
     
     st.header(f"Image {st.session_state.image_index + 1}/{len(images)}: {current_image_file}")
     
     try:
-        image = Image.open(image_path)
+        image = open_image(folder_path, current_image_file, shards)
         st.image(image, use_container_width=False)
     except Exception as e:
         st.error(f"Error loading image: {e}")